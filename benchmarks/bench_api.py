@@ -0,0 +1,253 @@
+"""Throughput and latency of every /api route on synthetic data, as JSON comparable across commits.
+
+    python -m benchmarks.bench_api --countries 250 --indicators 2000 --years 60 --output before.json
+    python -m benchmarks.bench_api --skip-generate --compare before.json --output after.json
+
+Every route is requested through the Flask test client (one request at a time,
+no HTTP) and then over HTTP by --concurrency threads, against a threaded local
+server or the running instance given by --url. The parameters of each request
+(countries, indicators, years) are drawn from a seeded generator, with another
+seed for the HTTP runs. Every run starts a new dataset generation, so responses
+cached by an earlier run or commit are not served; set EED_API_CACHE=0 to
+measure the routes without the response cache at all.
+
+Uses (and overwrites) the EED_BENCH_DB_NAME database, eed_bench by default; it
+refuses to run against the EED_DB_NAME database without --yes-overwrite.
+"""
+import argparse
+import json
+import platform
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlencode
+
+from benchmarks.common import add_bench_db_argument, check_bench_db, compare, git_commit, use_bench_db
+
+use_bench_db()
+
+import psycopg2  # noqa: E402
+from werkzeug.serving import WSGIRequestHandler, make_server  # noqa: E402
+
+from benchmarks.synthetic import INDICATOR_ID_OFFSET, generate  # noqa: E402
+from eed import create_app  # noqa: E402
+from eed.cache import API_CACHE_ENABLED  # noqa: E402
+from wbscript import run  # noqa: E402
+from wbscript.cube import CUBE_ENABLED  # noqa: E402
+
+
+class Scale:
+    """Keys of the synthetic data, to draw the parameters of the requests"""
+
+    def __init__(self, countries, indicators, years, start_year, aggregates):
+        self.country_ids = range(1, countries + 1)
+        self.indicator_ids = range(INDICATOR_ID_OFFSET, INDICATOR_ID_OFFSET + indicators)
+        self.start_year = start_year
+        self.end_year = start_year + years - 1
+        self.aggregates = aggregates
+
+    def years(self, rng, span):
+        start = rng.randint(self.start_year, max(self.start_year, self.end_year - span + 1))
+        return start, min(start + span - 1, self.end_year)
+
+    def indicators(self, rng, count):
+        return ','.join(str(i) for i in rng.sample(self.indicator_ids, min(count, len(self.indicator_ids))))
+
+    def countries(self, rng, count):
+        return ','.join(str(c) for c in rng.sample(self.country_ids, min(count, len(self.country_ids))))
+
+
+def route_urls(scale):
+    """url of a request of each route, from a random generator"""
+
+    def country_stats_indicators(rng):
+        return '/api/countries/{}/stats?indicator_ids={}'.format(rng.choice(scale.country_ids),
+                                                               scale.indicators(rng, 20))
+
+    def stats(rng):
+        start, end = scale.years(rng, 10)
+        return '/api/stats?' + urlencode({'countries': scale.countries(rng, 10),
+                                          'indicator_ids': scale.indicators(rng, 10), 'start': start, 'end': end})
+
+    def aggregate_stats(rng):
+        start, end = scale.years(rng, 10)
+        return '/api/aggregates/{}/stats?'.format(quote('Aggregate {}'.format(rng.randrange(scale.aggregates)))) + \
+            urlencode({'indicator_ids': scale.indicators(rng, 10), 'start': start, 'end': end})
+
+    def export(rng):
+        start, end = scale.years(rng, 10)
+        return '/api/export?' + urlencode({'countries': rng.choice(scale.country_ids),
+                                           'indicator_ids': scale.indicators(rng, 50), 'start': start, 'end': end})
+
+    return {
+        'indicators': lambda rng: '/api/indicators',
+        'countries': lambda rng: '/api/countries/',
+        'country': lambda rng: '/api/countries/{}'.format(quote('Country {}'.format(rng.choice(scale.country_ids)))),
+        'country_flag': lambda rng: '/api/countries/{}/flag'.format(rng.choice(scale.country_ids)),
+        'country_map': lambda rng: '/api/countries/{}/map'.format(rng.choice(scale.country_ids)),
+        'country_stats': lambda rng: '/api/countries/{}/stats'.format(rng.choice(scale.country_ids)),
+        'country_stats_indicators': country_stats_indicators,
+        'stats': stats,
+        'aggregate_stats': aggregate_stats,
+        'export': export,
+    }
+
+
+def summary(timings, seconds, errors=0):
+    """throughput and latency percentiles (nearest rank) of timings in ms"""
+    timings = sorted(timings)
+
+    def percentile(p):
+        return round(timings[max(0, -(-len(timings) * p // 100) - 1)], 3) if timings else None
+
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'rps': round(len(timings) / seconds, 2) if seconds else None,
+        'p50_ms': percentile(50),
+        'p95_ms': percentile(95),
+        'p99_ms': percentile(99),
+        'max_ms': round(timings[-1], 3) if timings else None,
+    }
+
+
+def bench_test_client(app, urls, requests, seed):
+    """one request at a time through the Flask test client, without HTTP"""
+    client = app.test_client()
+    results = {}
+    for name, url in urls.items():
+        rng = random.Random(seed)
+        # warm up the connections, snapshots and cube of the worker
+        client.get(url(rng)).close()
+        timings, errors = [], 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            request_url = url(rng)
+            request_started = time.perf_counter()
+            response = client.get(request_url)
+            response.get_data()
+            timings.append((time.perf_counter() - request_started) * 1000)
+            errors += response.status_code != 200
+            response.close()
+        results[name] = summary(timings, time.perf_counter() - started, errors)
+        print(name, json.dumps(results[name]))
+    return results
+
+
+def fetch(base_url, request_url):
+    """ms to get the whole body of request_url, None when it failed"""
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(base_url + request_url, timeout=60) as response:
+            response.read()
+    except (urllib.error.URLError, OSError):
+        return None
+    return (time.perf_counter() - started) * 1000
+
+
+def bench_http(base_url, urls, requests, concurrency, seed):
+    """requests per route sent by concurrency threads over HTTP"""
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for name, url in urls.items():
+            rng = random.Random(seed)
+            request_urls = [url(rng) for _ in range(requests)]
+            fetch(base_url, request_urls[0])
+            started = time.perf_counter()
+            timings = list(executor.map(lambda request_url: fetch(base_url, request_url), request_urls))
+            seconds = time.perf_counter() - started
+            errors = sum(1 for timing in timings if timing is None)
+            results[name] = summary([timing for timing in timings if timing is not None], seconds, errors)
+            print(name, json.dumps(results[name]))
+    return results
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def serve(app):
+    """threaded local server of app, returns its base url"""
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:{}'.format(server.server_port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--countries', type=int, default=250)
+    parser.add_argument('--indicators', type=int, default=2000)
+    parser.add_argument('--years', type=int, default=60)
+    parser.add_argument('--start-year', type=int, default=1960)
+    parser.add_argument('--aggregates', type=int, default=8)
+    parser.add_argument('--density', type=float, default=1.0, help='fraction of the cells which have a value')
+    parser.add_argument('--skip-generate', action='store_true', help='reuse the data of a previous run')
+    parser.add_argument('--requests', type=int, default=100, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--routes', help='comma separated routes to run, all by default')
+    parser.add_argument('--url', help='base url of a running instance for the HTTP runs, a local server by default')
+    parser.add_argument('--no-http', action='store_true', help='only run the test client')
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--compare', help='json file of a previous run to compare with')
+    add_bench_db_argument(parser)
+    args = parser.parse_args()
+    check_bench_db(args.yes_overwrite)
+
+    if not args.skip_generate:
+        run.create_db()
+        run.create_table()
+        run.upgrade_schema()
+        con = psycopg2.connect(dbname=run.DB_NAME, user=run.DB_USER, password=run.DB_PASS, host=run.DB_HOST)
+        generate(con, countries=args.countries, indicators=args.indicators, years=args.years,
+                 start_year=args.start_year, aggregates=args.aggregates, seed=args.seed, density=args.density,
+                 blobs=True)
+        con.close()
+    # responses cached by earlier runs are not served, the cube is published when enabled
+    run.new_generation()
+
+    scale = Scale(args.countries, args.indicators, args.years, args.start_year, args.aggregates)
+    urls = route_urls(scale)
+    if args.routes:
+        urls = {name: urls[name] for name in args.routes.split(',')}
+
+    app = create_app()
+    results = {'test_client': bench_test_client(app, urls, args.requests, args.seed)}
+    if not args.no_http:
+        results['http'] = bench_http(args.url or serve(app), urls, args.requests, args.concurrency, args.seed + 1)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'scale': {'countries': args.countries, 'indicators': args.indicators, 'years': args.years,
+                      'aggregates': args.aggregates, 'density': args.density},
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'seed': args.seed,
+            'url': args.url,
+            'api_cache': API_CACHE_ENABLED,
+            'cube': CUBE_ENABLED,
+        },
+        'results': results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump(report, outfile, indent=2)
+    if args.compare:
+        with open(args.compare) as infile:
+            baseline = json.load(infile).get('results', {})
+        # p50 and p95 relative to the baseline, per mode and route
+        for mode, routes in results.items():
+            compare(routes, baseline.get(mode, {}), ('p50_ms', 'p95_ms'), label=mode)
+
+
+if __name__ == '__main__':
+    main()
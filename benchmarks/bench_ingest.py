@@ -0,0 +1,271 @@
+"""Time of each stage of the World Bank ingestion (fetch, transform, load), offline.
+
+    python -m benchmarks.bench_ingest --countries 48 --indicators 127 --years 60 --output before.json
+    python -m benchmarks.bench_ingest --compare before.json --max-regression 0.2
+
+The World Bank API is replaced by the deterministic local stub of
+wbscript.stub_server, and every stage runs the functions of wbscript.run:
+
+    fetch      chunks fetched by the concurrent Fetcher, kept in memory
+    transform  translate_chunks + clean_rows of the fetched chunks
+    load       load_rows into an empty indicatorDB
+    upsert     load_rows of the same rows with conflict columns (delta refresh, nothing changes)
+    pipeline   fetch -> transform -> load streamed chunk by chunk, as retrieve_external_data
+
+Each stage reports its seconds (median of --repeat runs), rows/sec, peak RSS,
+database round trips and stub requests. Countries and indicators beyond those of
+the catalog are synthetic. With --compare, the exit status is 1 when the rows/sec
+of a stage dropped by more than --max-regression.
+
+Uses (and overwrites) the EED_BENCH_DB_NAME database, eed_bench by default; it
+refuses to run against the EED_DB_NAME database without --yes-overwrite.
+"""
+import argparse
+import json
+import platform
+import resource
+import statistics
+import sys
+import threading
+import time
+
+from benchmarks.common import add_bench_db_argument, check_bench_db, compare, git_commit, use_bench_db
+
+use_bench_db()
+
+import psycopg2  # noqa: E402
+import psycopg2.extensions  # noqa: E402
+
+from wbscript import db, run  # noqa: E402
+from wbscript.catalog import CountryRecord, IndicatorRecord, get_catalog  # noqa: E402
+from wbscript.fetch import Fetcher, make_chunks  # noqa: E402
+from wbscript.stub_server import start_stub_server  # noqa: E402
+
+SYNTHETIC_INDICATOR_ID_OFFSET = 900000
+STATM_PATH = '/proc/self/statm'
+
+
+class RoundTrips:
+    """Statements, COPYs, commits and rollbacks sent by the connections of the pool"""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self):
+        with self.lock:
+            self.count += 1
+
+
+round_trips = RoundTrips()
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+
+    def execute(self, *args, **kwargs):
+        round_trips.add()
+        return super().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        round_trips.add()
+        return super().executemany(*args, **kwargs)
+
+    def copy_expert(self, *args, **kwargs):
+        round_trips.add()
+        return super().copy_expert(*args, **kwargs)
+
+
+class CountingConnection(psycopg2.extensions.connection):
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault('cursor_factory', CountingCursor)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        round_trips.add()
+        return super().commit()
+
+    def rollback(self):
+        round_trips.add()
+        return super().rollback()
+
+
+class RssSampler:
+    """Peak resident set size while the block runs, sampled from /proc (getrusage peak elsewhere)"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start = self.peak = rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+
+def rss_bytes():
+    try:
+        with open(STATM_PATH) as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # peak of the whole process, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def extend_catalog(countries, indicators):
+    """add synthetic countries and indicators to the catalog until there are as many as requested"""
+    catalog = get_catalog()
+    for n in range(len(catalog.countries), countries):
+        catalog.add_country(CountryRecord(n + 1, 'Synthetic country {}'.format(n), 'Z{}'.format(n),
+                                          'SYN{:04}'.format(n)))
+    for n in range(len(catalog.indicators), indicators):
+        catalog.add_indicator(IndicatorRecord(SYNTHETIC_INDICATOR_ID_OFFSET + n, 'SYN.{}'.format(n),
+                                              'Synthetic indicator {}'.format(n), 'Synthetic', 'Synthetic',
+                                              'Synthetic'))
+    return catalog.countries[:countries], catalog.indicators[:indicators]
+
+
+def measure(stage, repeat, stub, setup=None):
+    """run stage() repeat times (after setup()), stage returns its number of rows"""
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        requests, trips = stub.request_count, round_trips.count
+        with RssSampler() as rss:
+            started = time.perf_counter()
+            rows = stage()
+            seconds = time.perf_counter() - started
+        runs.append({
+            'seconds': seconds,
+            'rows': rows,
+            'peak_rss_mb': rss.peak / 2 ** 20,
+            'rss_growth_mb': (rss.peak - rss.start) / 2 ** 20,
+            'db_round_trips': round_trips.count - trips,
+            'http_requests': stub.request_count - requests,
+        })
+    seconds = statistics.median(run['seconds'] for run in runs)
+    rows = runs[-1]['rows']
+    return {
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'min_seconds': round(min(run['seconds'] for run in runs), 4),
+        'max_seconds': round(max(run['seconds'] for run in runs), 4),
+        'rows_per_sec': round(rows / seconds, 1) if seconds else None,
+        'peak_rss_mb': round(max(run['peak_rss_mb'] for run in runs), 1),
+        'rss_growth_mb': round(max(run['rss_growth_mb'] for run in runs), 1),
+        'db_round_trips': runs[-1]['db_round_trips'],
+        'http_requests': runs[-1]['http_requests'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--countries', type=int, default=48)
+    parser.add_argument('--indicators', type=int, default=127)
+    parser.add_argument('--years', type=int, default=60)
+    parser.add_argument('--start-year', type=int, default=1960)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every stub response')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--compare', help='json file of a previous run to compare with')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='largest accepted drop of rows/sec against --compare, 0.2 = 20%%')
+    add_bench_db_argument(parser)
+    args = parser.parse_args()
+    check_bench_db(args.yes_overwrite)
+
+    stub = start_stub_server(latency=args.latency, seed=args.seed)
+    countries, indicators = extend_catalog(args.countries, args.indicators)
+    start_year, end_year = args.start_year, args.start_year + args.years - 1
+
+    run.create_db()
+    run.create_table()
+    run.upgrade_schema()
+    # every connection of the pool counts its round trips
+    db.pool.close_all()
+    db.pool = db.Pool(dbname=db.DB_NAME, user=db.DB_USER, password=db.DB_PASS, host=db.DB_HOST,
+                      connection_factory=CountingConnection)
+    run.truncate_table('aggregateStatsDB, aggregateDB, indicatorDB, indicatorMetaDB, countryDB')
+    run.init_dataset()
+    run.insert_table('countryDB', run.country_list)
+    run.load_rows('indicatorMetaDB', run.INDICATOR_META_COLUMNS,
+                  (tuple(item[column] for column in run.INDICATOR_META_COLUMNS) for item in run.indicator_list))
+
+    fetcher = Fetcher(api_url=stub.api_url)
+    chunks = list(make_chunks([indicator.api_code for indicator in indicators],
+                              [country.iso3 for country in countries]))
+    fetched, rows = [], []
+
+    def fetch():
+        fetched[:] = [(result.chunk.indicator_code, result.rows)
+                      for result in fetcher.fetch(chunks, start_year, end_year) if result.error is None]
+        return sum(len(chunk_rows) for _, chunk_rows in fetched)
+
+    def transform():
+        rows[:] = run.clean_rows(run.translate_chunks(fetched, set()))
+        return len(rows)
+
+    def load(conflict_columns=None):
+        return run.load_rows('indicatorDB', run.INDICATOR_COLUMNS, rows, conflict_columns).rows
+
+    def pipeline():
+        streamed = ((result.chunk.indicator_code, result.rows)
+                    for result in fetcher.fetch(chunks, start_year, end_year) if result.error is None)
+        return load_streamed(run.clean_rows(run.translate_chunks(streamed, set())))
+
+    def load_streamed(streamed_rows):
+        return run.load_rows('indicatorDB', run.INDICATOR_COLUMNS, streamed_rows).rows
+
+    def empty_indicators():
+        run.truncate_table('indicatorDB')
+
+    stages = {
+        'fetch': measure(fetch, args.repeat, stub),
+        'transform': measure(transform, args.repeat, stub),
+        'load': measure(load, args.repeat, stub, setup=empty_indicators),
+        'upsert': measure(lambda: load(run.INDICATOR_KEY), args.repeat, stub),
+        'pipeline': measure(pipeline, args.repeat, stub, setup=empty_indicators),
+    }
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'scale': {'countries': args.countries, 'indicators': args.indicators, 'years': args.years,
+                      'chunks': len(chunks)},
+            'latency': args.latency,
+            'seed': args.seed,
+            'repeat': args.repeat,
+        },
+        'stages': stages,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump(report, outfile, indent=2)
+    if args.compare:
+        with open(args.compare) as infile:
+            ratios = compare(stages, json.load(infile).get('stages', {}),
+                             ('rows_per_sec', 'db_round_trips', 'peak_rss_mb'))
+        regressions = [name for name, stage_ratios in ratios.items()
+                       if stage_ratios.get('rows_per_sec', 1) < 1 - args.max_regression]
+        if regressions:
+            print('rows/sec regressed by more than {:.0%}: {}'.format(args.max_regression, ', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
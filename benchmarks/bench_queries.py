@@ -0,0 +1,121 @@
+"""Latency of the parameterized wbscript queries against the former OR-chain SQL.
+
+    python -m benchmarks.bench_queries --countries 200 --years 50
+
+Uses (and overwrites) the EED_BENCH_DB_NAME database, eed_bench by default; it
+refuses to run against the EED_DB_NAME database without --yes-overwrite.
+"""
+import argparse
+import json
+import statistics
+import time
+
+from benchmarks.common import add_bench_db_argument, check_bench_db, use_bench_db
+
+use_bench_db()
+
+import psycopg2  # noqa: E402
+
+from benchmarks.synthetic import INDICATOR_ID_OFFSET, generate  # noqa: E402
+from wbscript import queries, run  # noqa: E402
+
+
+def legacy_country_sum(country_id, indicator_id, start, end):
+    # SQL as built by retrievecountryfromsql before the query module
+    commands = '''
+        SELECT SUM(indicator_value) as sum_indicator_value FROM indicatorDB
+        WHERE country_id = {} AND
+        indicator_id = {} AND (
+    '''.format(country_id, indicator_id)
+    for year in range(start, end + 1):
+        commands += 'year = {} OR '.format(year)
+    return commands[:-3] + ')'
+
+
+def legacy_aggregate_sum(country_ids, indicator_id, start, end):
+    # SQL as built by retrieveaggregatefromsql before the query module
+    commands = '''
+        SELECT SUM(indicator_value) as sum_indicator_value FROM indicatorDB
+        WHERE indicator_id = {} AND (
+    '''.format(indicator_id)
+    for c in country_ids:
+        commands += 'country_id = {} OR '.format(c)
+    commands = commands[:-3] + ')  AND ('
+    for y in range(start, end + 1):
+        commands += 'year = {} OR '.format(y)
+    return commands[:-3] + ')'
+
+
+def measure(run_once, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run_once()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--countries', type=int, default=200)
+    parser.add_argument('--indicators', type=int, default=20)
+    parser.add_argument('--years', type=int, default=50)
+    parser.add_argument('--start-year', type=int, default=1970)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--skip-generate', action='store_true', help='reuse the data of a previous run')
+    add_bench_db_argument(parser)
+    args = parser.parse_args()
+    check_bench_db(args.yes_overwrite)
+
+    if not args.skip_generate:
+        run.create_db()
+        run.create_table()
+        run.upgrade_schema()
+    con = psycopg2.connect(dbname=run.DB_NAME, user=run.DB_USER, password=run.DB_PASS, host=run.DB_HOST)
+    if not args.skip_generate:
+        generate(con, countries=args.countries, indicators=args.indicators, years=args.years,
+                 start_year=args.start_year)
+    con.autocommit = True
+    cur = con.cursor()
+
+    country_ids = list(range(1, args.countries + 1))
+    indicator_id = INDICATOR_ID_OFFSET
+    start, end = args.start_year, args.start_year + args.years - 1
+
+    def legacy(sql):
+        return lambda: (cur.execute(sql), cur.fetchall())
+
+    def prepared(query, params):
+        return lambda: (query.execute(cur, params), cur.fetchall())
+
+    cases = {
+        'country_sum_{}_years'.format(args.years): (
+            legacy(legacy_country_sum(1, indicator_id, start, end)),
+            prepared(queries.COUNTRY_STATISTICS['SUM'], (1, indicator_id, start, end)),
+        ),
+        'aggregate_sum_{}_countries_{}_years'.format(args.countries, args.years): (
+            legacy(legacy_aggregate_sum(country_ids, indicator_id, start, end)),
+            prepared(queries.AGGREGATE_STATISTICS['SUM'], (country_ids, indicator_id, start, end)),
+        ),
+    }
+
+    results = {}
+    for name, (legacy_run, prepared_run) in cases.items():
+        # warm up caches and the prepared statements
+        legacy_run()
+        prepared_run()
+        results[name] = {
+            'or_chain': measure(legacy_run, args.repeat),
+            'parameterized': measure(prepared_run, args.repeat),
+        }
+    con.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
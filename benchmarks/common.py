@@ -0,0 +1,47 @@
+"""Helpers shared by the benchmarks"""
+import os
+import subprocess
+import sys
+
+# the database of the application, wbscript.db and eed default to test_worldbank
+APP_DB_NAME = os.getenv('EED_DB_NAME', 'test_worldbank')
+# the database the benchmarks fill with synthetic data, overwriting it
+BENCH_DB_NAME = os.getenv('EED_BENCH_DB_NAME', 'eed_bench')
+
+
+def use_bench_db():
+    """point EED_DB_NAME at the benchmark database, before wbscript or eed read it"""
+    os.environ['EED_DB_NAME'] = BENCH_DB_NAME
+
+
+def check_bench_db(yes_overwrite=False):
+    """exit when the benchmark database is the one of the application, unless yes_overwrite"""
+    if BENCH_DB_NAME == APP_DB_NAME and not yes_overwrite:
+        sys.exit('EED_BENCH_DB_NAME is {!r}, the EED_DB_NAME database, which the benchmark would overwrite; '
+                 'pass --yes-overwrite to run it anyway'.format(BENCH_DB_NAME))
+
+
+def add_bench_db_argument(parser):
+    parser.add_argument('--yes-overwrite', action='store_true',
+                        help='run even when EED_BENCH_DB_NAME is the EED_DB_NAME database')
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, keys, label=None):
+    """print current / baseline of keys for every named result of both, returns these ratios by name"""
+    ratios = {}
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        ratios[name] = {key: current[key] / previous[key] for key in keys if current.get(key) and previous.get(key)}
+        print('{:38} {}'.format('{} {}'.format(label, name) if label else name,
+                                ', '.join('{} {:.2f}x'.format(key, ratio) for key, ratio in ratios[name].items())))
+    return ratios
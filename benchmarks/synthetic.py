@@ -0,0 +1,81 @@
+"""Synthetic countryDB / indicatorMetaDB / indicatorDB / aggregateDB data at configurable scale"""
+import random
+import time
+
+from wbscript.aggregates import refresh_aggregate_stats
+from wbscript.loader import bulk_load
+
+INDICATOR_ID_OFFSET = 1000
+# flags and maps are PNG signatures padded to these sizes
+FLAG_BYTES = 4 * 1024
+MAP_BYTES = 64 * 1024
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# generated server-side: 250 countries x 2,000 indicators x 60 years do not go through python
+INDICATOR_VALUES_SQL = '''
+    INSERT INTO indicatorDB (country_id, indicator_id, year, indicator_value)
+    SELECT c, i, y, round((random() * 1000)::numeric, 2)
+    FROM generate_series(1, %(countries)s) c,
+         generate_series(%(first_indicator)s, %(last_indicator)s) i,
+         generate_series(%(start_year)s, %(end_year)s) y
+    WHERE %(density)s >= 1 OR random() < %(density)s
+'''
+
+
+def blob(size, seed):
+    size -= len(PNG_SIGNATURE)
+    return PNG_SIGNATURE + random.Random(seed).getrandbits(8 * size).to_bytes(size, 'little')
+
+
+def generate(con, countries=48, indicators=127, years=10, start_year=2010, aggregates=4, seed=0, density=1.0,
+             blobs=False):
+    """replace the content of the tables with countries x indicators x years random values
+
+    density is the fraction of the cells which have a value, blobs adds flags and maps to the countries.
+    """
+    rng = random.Random(seed)
+    with con:
+        with con.cursor() as cur:
+            cur.execute('TRUNCATE aggregateStatsDB, aggregateDB, indicatorDB, indicatorMetaDB, countryDB CASCADE')
+
+    country_ids = range(1, countries + 1)
+    indicator_ids = range(INDICATOR_ID_OFFSET, INDICATOR_ID_OFFSET + indicators)
+    country_columns = ('country_id', 'country_name', 'country_ISOid')
+    if blobs:
+        country_columns += ('country_flag', 'country_map')
+    print(bulk_load(con, 'countryDB', country_columns,
+                    ((c, 'Country {}'.format(c), 'C{}'.format(c)) +
+                     ((blob(FLAG_BYTES, c), blob(MAP_BYTES, -c)) if blobs else ())
+                     for c in country_ids)))
+    print(bulk_load(con, 'indicatorMetaDB',
+                    ('indicator_id', 'indicator_api_code', 'indicator_name', 'indicator_description',
+                     'indicator_source', 'indicator_topic'),
+                    ((i, 'SYN.{}'.format(i), 'Indicator {}'.format(i), 'Synthetic indicator {}'.format(i),
+                      'Synthetic', 'Topic {}'.format(i % 10)) for i in indicator_ids)))
+
+    started = time.perf_counter()
+    with con:
+        with con.cursor() as cur:
+            # setseed makes random() repeatable, its argument is in [-1, 1]
+            cur.execute('SELECT setseed(%s)', (rng.uniform(-1, 1),))
+            cur.execute(INDICATOR_VALUES_SQL, {
+                'countries': countries,
+                'first_indicator': INDICATOR_ID_OFFSET,
+                'last_indicator': INDICATOR_ID_OFFSET + indicators - 1,
+                'start_year': start_year,
+                'end_year': start_year + years - 1,
+                'density': density,
+            })
+            rows = cur.rowcount
+    print('indicatorDB: {} rows generated in {:.2f}s'.format(rows, time.perf_counter() - started))
+
+    # countries are split round-robin between the aggregates
+    print(bulk_load(con, 'aggregateDB',
+                    ('aggregate_name', 'aggregate_description', 'aggregate_area', 'country_id'),
+                    (('Aggregate {}'.format(c % aggregates), 'Synthetic aggregate', 1, c) for c in country_ids)))
+    refresh_aggregate_stats(con)
+
+    con.autocommit = True
+    with con.cursor() as cur:
+        cur.execute('ANALYZE')
+    con.autocommit = False
@@ -4,6 +4,7 @@ from flask import Flask, jsonify
 
 from eed.admin import setup_admin
 from eed.api import stats_api_bp
+from eed.metrics import setup_metrics
 from eed.models import db
 
 
@@ -26,6 +27,7 @@ def create_app(**kwargs):
     app.register_blueprint(stats_api_bp)
 
     setup_admin(app, db)
+    setup_metrics(app)
 
     @app.route("/ping")
     def ping_pong():
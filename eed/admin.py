@@ -2,18 +2,25 @@
 import multiprocessing
 import os
 
-from flask import request
+from flask import g, jsonify, request, url_for
 from flask_admin import Admin, BaseView, expose
 from flask_admin.contrib import sqla
 from flask_basicauth import BasicAuth
+from sqlalchemy import BigInteger, case, cast, func, text, tuple_
+from sqlalchemy.sql import column, table
 from werkzeug import Response
 from werkzeug.exceptions import HTTPException
 from werkzeug.utils import redirect
 
-from eed.models import Country, Indicator, Aggregate
-from wbscript.run import retrieve_external_data, init_dataset
+from eed.cache import bump_generation
+from eed.models import Country, Indicator, IndicatorMeta, Aggregate
+from wbscript import jobs
+from wbscript.db import connection
+from wbscript.run import REFRESH_MODES, run_load_job
 
 basic_auth = BasicAuth()
+# rows counted exactly when the planner has no estimate of the indicator rows yet
+EXACT_COUNT_LIMIT = 100_000
 
 
 def setup_admin(app, db_conn):
@@ -30,6 +37,7 @@ def setup_admin(app, db_conn):
     admin = Admin(app, name="eed", template_mode="bootstrap3")
     admin.add_view(ModelViewWithAuth(Country, db_conn.session))
     admin.add_view(IndicatorModelView(Indicator, db_conn.session))
+    admin.add_view(IndicatorMetaModelView(IndicatorMeta, db_conn.session))
     admin.add_view(AggregateModelView(Aggregate, db_conn.session))
 
     admin.add_view(
@@ -62,24 +70,127 @@ class ModelViewWithAuth(sqla.ModelView):
     def inaccessible_callback(self, name, **kwargs):
         return redirect(basic_auth.challenge())
 
+    def after_model_change(self, form, model, is_created):
+        bump_generation()
+
+    def after_model_delete(self, model):
+        bump_generation()
+
 
 class IndicatorModelView(ModelViewWithAuth):
-    """ModelView for Indicator"""
+    """ModelView for Indicator
+
+    Without a sort column the list is paged by (country_id, indicator_id, year)
+    keys instead of OFFSET, and without search or filters the count is the
+    planner estimate of pg_class instead of COUNT(*). Before the first ANALYZE
+    (no estimate, or 0 after a TRUNCATE) the rows are counted up to
+    EXACT_COUNT_LIMIT."""
 
     page_size = 100
+    list_template = "admin_indicator_list.html"
     column_list = (
         "indicator_id",
-        "indicator_api_code",
+        "meta.indicator_api_code",
         "country",
         "year",
         "indicator_value",
-        "indicator_name",
-        "indicator_description",
-        "indicator_source",
-        "indicator_topic",
+        "meta.indicator_name",
+        "meta.indicator_description",
+        "meta.indicator_source",
+        "meta.indicator_topic",
     )
-    column_searchable_list = ("indicator_id", "country.country_name", "year")
-    column_filters = ("country.country_name", "year")
+    # ILIKE on the names uses their trigram indexes, ids and years are filters
+    column_searchable_list = ("country.country_name", "meta.indicator_name")
+    column_filters = ("country.country_name", "indicator_id", "year")
+
+    def get_list(
+        self,
+        page,
+        sort_column,
+        sort_desc,
+        search,
+        filters,
+        execute=True,
+        page_size=None,
+    ):
+        g.indicator_estimated_count = not search and not filters
+        g.indicator_keyset = None
+        if sort_column is None:
+            g.indicator_keyset = {"after": parse_keyset(request.args.get("after"))}
+        count, data = super().get_list(
+            page, sort_column, sort_desc, search, filters, execute, page_size
+        )
+        keyset = g.indicator_keyset
+        if keyset is not None and execute:
+            page_size = page_size or self.page_size
+            keyset["next"] = None
+            if page_size and len(data) == page_size:
+                last = data[-1]
+                keyset["next"] = (last.country_id, last.indicator_id, last.year)
+        return count, data
+
+    def get_count_query(self):
+        if g.get("indicator_estimated_count"):
+            pg_class = table("pg_class", column("oid"), column("reltuples"))
+            rows = self.session.query(Indicator.year).limit(EXACT_COUNT_LIMIT)
+            exact_count = (
+                self.session.query(func.count())
+                .select_from(rows.subquery())
+                .as_scalar()
+            )
+            estimate = cast(pg_class.c.reltuples, BigInteger)
+            return self.session.query(
+                case([(pg_class.c.reltuples > 0, estimate)], else_=exact_count)
+            ).filter(pg_class.c.oid == text("'indicatordb'::regclass"))
+        return super().get_count_query()
+
+    def _apply_pagination(self, query, page, page_size):
+        keyset = g.get("indicator_keyset")
+        if keyset is None or (page and keyset["after"] is None):
+            return super()._apply_pagination(query, page, page_size)
+        if page_size is None:
+            page_size = self.page_size
+        key = tuple_(Indicator.country_id, Indicator.indicator_id, Indicator.year)
+        query = query.order_by(None).order_by(
+            Indicator.country_id, Indicator.indicator_id, Indicator.year
+        )
+        if keyset["after"] is not None:
+            query = query.filter(key > tuple_(*keyset["after"]))
+        if page_size:
+            query = query.limit(page_size)
+        return query
+
+    def render(self, template, **kwargs):
+        keyset = g.get("indicator_keyset")
+        if keyset is not None and "next" in keyset:
+            args = request.args.to_dict()
+            args.pop("page", None)
+            args.pop("after", None)
+            kwargs["keyset_first_url"] = url_for(".index_view", **args)
+            kwargs["keyset_next_url"] = None
+            if keyset["next"]:
+                after = ",".join(str(key) for key in keyset["next"])
+                kwargs["keyset_next_url"] = url_for(".index_view", after=after, **args)
+            kwargs["keyset_after"] = keyset["after"]
+        return super().render(template, **kwargs)
+
+
+def parse_keyset(after):
+    """(country_id, indicator_id, year) of the after arg, None if missing or invalid"""
+    try:
+        keys = tuple(int(key) for key in after.split(","))
+    except (AttributeError, ValueError):
+        return None
+    return keys if len(keys) == 3 else None
+
+
+class IndicatorMetaModelView(ModelViewWithAuth):
+    """ModelView for IndicatorMeta"""
+
+    page_size = 100
+    column_display_pk = True
+    column_searchable_list = ("indicator_api_code", "indicator_name", "indicator_topic")
+    column_filters = ("indicator_source", "indicator_topic")
 
 
 class AggregateModelView(ModelViewWithAuth):
@@ -102,42 +213,53 @@ class AggregateModelView(ModelViewWithAuth):
 
 
 class RunWBScriptView(BaseView):
-    """View for running wbscript process"""
-
-    wbscript_process = None
+    """View for running wbscript load jobs and following their progress"""
 
     @expose("/")
     def index(self):
         """World Bank Load data index page"""
-        if RunWBScriptView.is_wbscript_running():
-            return self.render("admin_wbscript.html", started=True)
-        return self.render("admin_wbscript.html")
+        # reap the load processes of this worker which finished
+        multiprocessing.active_children()
+        with connection() as con:
+            job = jobs.fetch_job(con)
+            if is_active(job) and jobs.reap_interrupted(con):
+                job = jobs.fetch_job(con)
+        return self.render("admin_wbscript.html", job=job, active=is_active(job))
 
     @expose("/run_wbscript")
     def run(self):
-        """Route to run wbscript"""
-        if RunWBScriptView.is_wbscript_running():
-            return self.render("admin_wbscript.html", started=True)
-
-        start_year = int(request.args.get("start", "2010"))
-        end_year = int(request.args.get("end", "2020"))
-        RunWBScriptView.wbscript_process = multiprocessing.Process(
-            target=self.run_wbscript, args=(start_year, end_year)
-        )
-        RunWBScriptView.wbscript_process.start()
-        return self.render("admin_wbscript.html", started=True)
-
-    @staticmethod
-    def is_wbscript_running():
-        """Checks if the script is running"""
-        return (
-                RunWBScriptView.wbscript_process
-                and RunWBScriptView.wbscript_process.is_alive()
-        )
+        """Route to queue a load job, started unless a load is already running"""
+        start_year = int(request.args.get("start") or "2010")
+        end_year = int(request.args.get("end") or "2020")
+        mode = request.args.get("mode", "full")
+        if mode not in REFRESH_MODES:
+            mode = "full"
+        with connection() as con:
+            if jobs.load_running(con) or is_active(jobs.fetch_job(con)):
+                return redirect(url_for(".index"))
+            job_id = jobs.create_job(con, start_year, end_year, mode)
+        # only the job takes the load lock, a job started by another worker at
+        # the same time fails with "another load is running"
+        multiprocessing.Process(
+            target=run_load_job, args=(job_id, start_year, end_year, mode)
+        ).start()
+        return redirect(url_for(".index"))
+
+    @expose("/status")
+    def status(self):
+        """Latest job as json, polled by the index page"""
+        with connection() as con:
+            job = jobs.fetch_job(con)
+        return jsonify(job=job, active=is_active(job))
+
+    @expose("/cancel/<int:job_id>", methods=("POST",))
+    def cancel(self, job_id):
+        """Route to cancel a queued or running job"""
+        with connection() as con:
+            jobs.request_cancel(con, job_id)
+        return redirect(url_for(".index"))
+
 
-    @staticmethod
-    def run_wbscript(start_year, end_year):
-        """Run wbscript"""
-        print("RunWBScript")
-        init_dataset()
-        retrieve_external_data(start_year=start_year, end_year=end_year)
+def is_active(job):
+    """True when the job is queued or running"""
+    return job is not None and job["state"] in jobs.ACTIVE_STATES
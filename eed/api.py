@@ -1,32 +1,58 @@
 """API endpoints for countries and stats"""
-from collections import defaultdict
-from typing import Dict, List, Any, DefaultDict
+from flask import Blueprint, abort, current_app, request, stream_with_context
+from sqlalchemy import Float, cast, func, or_
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array_agg
 
-from flask import Blueprint, request
-from sqlalchemy import or_
-
-from eed.models import Country, Indicator
+from eed.cache import cached_response
+from eed.catalog import indicator_catalog
+from eed.cube import (
+    cube_aggregate_stats,
+    cube_country_stats,
+    cube_stats,
+    current_cube,
+)
+from eed.export import EXPORT_FORMATS, export_chunks
+from eed.formats import stats_response
+from eed.models import Aggregate, Country, Indicator, IndicatorMeta, db
+from eed.pivot import keyed_rows, pivot, to_lists
+from eed.resolver import country_resolver
 
 stats_api_bp = Blueprint("country_stats", __name__, url_prefix="/api")
 
+EXPORT_BATCH_SIZE = 5000
+# widest start - end range of /api/stats, whose years axis is dense
+MAX_YEAR_SPAN = 200
+# an SVG flag or map must not run script or load anything from the API origin
+SVG_CONTENT_SECURITY_POLICY = "default-src 'none'; style-src 'unsafe-inline'"
+IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"RIFF", "image/webp"),
+)
+AGGREGATE_STATS_FIELDS = (
+    "indicator_id",
+    "year",
+    "sum",
+    "avg",
+    "min",
+    "max",
+    "count",
+    "argmin_country_id",
+    "argmax_country_id",
+)
+
 
 @stats_api_bp.route("/indicators")
+@cached_response()
 def indicators_list():
     """All indicators list"""
-    indicators = Indicator.query.distinct(Indicator.indicator_id).all()
-    indicators_details = {}
-    for ind in indicators:
-        indicators_details[ind.indicator_id] = {
-            "api_code": ind.indicator_api_code,
-            "name": ind.indicator_name,
-            "description": ind.indicator_description,
-            "source": ind.indicator_source,
-            "topics": ind.indicator_topic,
-        }
-    return indicators_details
+    return indicator_catalog()
 
 
 @stats_api_bp.route("/countries/")
+@cached_response()
 def countries():
     """All countries list"""
     res_countries = Country.query.all()
@@ -34,57 +60,369 @@ def countries():
 
 
 @stats_api_bp.route("/countries/<country_id_or_name>")
+@cached_response()
 def country(country_id_or_name):
     """Country by ID or Name or ISOCode"""
     country_res = get_country_by_id_or_name(country_id_or_name)
     return country_res.res_dict()
 
 
+@stats_api_bp.route("/countries/<country_id_or_name>/flag")
+def country_flag(country_id_or_name):
+    """Flag image of a country"""
+    return blob_response(country_id_or_name, Country.country_flag, "flag")
+
+
+@stats_api_bp.route("/countries/<country_id_or_name>/map")
+def country_map(country_id_or_name):
+    """Map image of a country"""
+    return blob_response(country_id_or_name, Country.country_map, "map")
+
+
 @stats_api_bp.route("/countries/<country_id_or_name>/stats")
+@cached_response(list_args=("indicator_ids",))
 def country_stats(country_id_or_name):
     """stats for a country
 
     indicator_ids - get parameter to specify list of indicators
-    (if not specified - all indicators)"""
-    country_res = get_country_by_id_or_name(country_id_or_name)
-    res_dict = {"country_id": country_res.country_id}
+    (if not specified - all indicators)
+
+    JSON by default, see eed.formats for the binary formats"""
+    country_id = resolve_country_id(country_id_or_name)
+    indicator_ids = [int_arg(i) for i in split_arg("indicator_ids")]
+
+    cube = current_cube()
+    if cube is not None:
+        indicator_keys, years, values = cube_country_stats(
+            cube, country_id, indicator_ids
+        )
+    else:
+        # (indicator_id, year, value) tuples only, read from the primary key index
+        values_query = db.session.query(
+            Indicator.indicator_id,
+            Indicator.year,
+            cast(Indicator.indicator_value, Float),
+        ).filter(Indicator.country_id == country_id)
+        if indicator_ids:
+            values_query = values_query.filter(
+                Indicator.indicator_id.in_(indicator_ids)
+            )
+        (indicator_keys, years), values = pivot(values_query.all())
+
+    return stats_response(
+        lambda: {
+            "country_id": country_id,
+            "years": years.tolist(),
+            "indicator_values": keyed_rows(indicator_keys, values),
+        },
+        {"indicator_id": indicator_keys, "year": years},
+        values,
+        country_id=country_id,
+    )
+
+
+@stats_api_bp.route("/stats")
+@cached_response(list_args=("indicator_ids",))
+def stats():
+    """stats for several countries as a dense country x indicator x year matrix
+
+    countries - ids, names or iso codes of the countries, in the order of the result
+    indicator_ids - indicators to include (if not specified - all indicators)
+    start, end - years range (if not specified - all years), at most
+        MAX_YEAR_SPAN years, clamped to the years which have data
+
+    JSON by default, see eed.formats for the binary formats"""
+    country_ids = resolve_country_ids(split_arg("countries"))
+    indicator_ids = sorted({int_arg(i) for i in split_arg("indicator_ids")}) or None
+    start, end = year_range_args()
+
+    cube = current_cube()
+    if cube is not None:
+        country_keys = country_ids
+        indicator_keys, year_keys, values = cube_stats(
+            cube, country_ids, indicator_ids, start, end
+        )
+    else:
+        values_query = db.session.query(
+            Indicator.country_id,
+            Indicator.indicator_id,
+            Indicator.year,
+            cast(Indicator.indicator_value, Float),
+        ).filter(Indicator.country_id.in_(country_ids))
+        if indicator_ids:
+            values_query = values_query.filter(
+                Indicator.indicator_id.in_(indicator_ids)
+            )
+        if start is not None:
+            values_query = values_query.filter(Indicator.year >= start)
+        if end is not None:
+            values_query = values_query.filter(Indicator.year <= end)
+        years = None
+        if None not in (start, end):
+            # the years axis only spans the years which have data
+            first, last = db.session.query(
+                func.min(Indicator.year), func.max(Indicator.year)
+            ).one()
+            years = [] if first is None else range(max(start, first), min(end, last) + 1)
+        (country_keys, indicator_keys, year_keys), values = pivot(
+            values_query.all(), axes=(country_ids, indicator_ids, years)
+        )
+
+    return stats_response(
+        lambda: {
+            "country_ids": country_ids,
+            "indicator_ids": indicator_keys.tolist(),
+            "years": year_keys.tolist(),
+            "values": to_lists(values),
+        },
+        {"country_id": country_keys, "indicator_id": indicator_keys, "year": year_keys},
+        values,
+    )
+
+
+@stats_api_bp.route("/aggregates/<aggregate_name>/stats")
+@cached_response(list_args=("indicator_ids",))
+def aggregate_stats(aggregate_name):
+    """stats of the countries of an aggregate, for every indicator and year
+
+    indicator_ids - indicators to include (if not specified - all indicators)
+    start, end - years range (if not specified - all years), at most
+        MAX_YEAR_SPAN years"""
+    indicator_ids = [int_arg(i) for i in split_arg("indicator_ids")]
+    start, end = year_range_args()
+
+    cube = current_cube()
+    if cube is not None:
+        member_ids = [
+            member_id
+            for (member_id,) in db.session.query(Aggregate.country_id)
+            .filter(Aggregate.aggregate_name == aggregate_name)
+            .distinct()
+        ]
+        if not member_ids:
+            abort(404, description='Aggregate "{}" not found'.format(aggregate_name))
+        rows = cube_aggregate_stats(cube, member_ids, indicator_ids, start, end)
+        return {
+            "aggregate_name": aggregate_name,
+            "stats": [dict(zip(AGGREGATE_STATS_FIELDS, row)) for row in rows],
+        }
+
+    members = (
+        db.session.query(Aggregate.country_id)
+        .filter(Aggregate.aggregate_name == aggregate_name)
+        .distinct()
+        .subquery()
+    )
+    country_id, value = Indicator.country_id, Indicator.indicator_value
+    has_value = value.isnot(None)
+    # one group per (indicator, year), arg min/max break ties by country_id
+    # and skip NULL values, which sort first with DESC
+    stats_query = (
+        db.session.query(
+            Indicator.indicator_id,
+            Indicator.year,
+            cast(func.sum(value), Float),
+            cast(func.avg(value), Float),
+            cast(func.min(value), Float),
+            cast(func.max(value), Float),
+            func.count(value),
+            array_agg(aggregate_order_by(country_id, value.asc(), country_id)).filter(
+                has_value
+            )[1],
+            array_agg(aggregate_order_by(country_id, value.desc(), country_id)).filter(
+                has_value
+            )[1],
+        )
+        .join(members, members.c.country_id == country_id)
+        .group_by(Indicator.indicator_id, Indicator.year)
+        .order_by(Indicator.indicator_id, Indicator.year)
+    )
+    if indicator_ids:
+        stats_query = stats_query.filter(Indicator.indicator_id.in_(indicator_ids))
+    if start is not None:
+        stats_query = stats_query.filter(Indicator.year >= start)
+    if end is not None:
+        stats_query = stats_query.filter(Indicator.year <= end)
+
+    rows = stats_query.all()
+    if not rows:
+        Aggregate.query.filter(Aggregate.aggregate_name == aggregate_name).first_or_404(
+            description='Aggregate "{}" not found'.format(aggregate_name)
+        )
+    return {
+        "aggregate_name": aggregate_name,
+        "stats": [dict(zip(AGGREGATE_STATS_FIELDS, row)) for row in rows],
+    }
 
-    indicators_query = Indicator.query.filter(
-        Indicator.country_id == country_res.country_id
-    ).order_by(Indicator.year)
-    indicator_ids = request.args.get("indicator_ids")
+
+@stats_api_bp.route("/export")
+def export():
+    """stream indicator values, one row per (country, indicator, year)
+
+    format - ndjson (default) or csv
+    countries, indicator_ids, topics - comma separated filters (if not specified - all)
+    start, end - years range (if not specified - all years)
+    The rows are gzipped when the client accepts it."""
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        formats = ", ".join(EXPORT_FORMATS)
+        abort(400, description="format must be one of {}".format(formats))
+    countries = split_arg("countries")
+    indicator_ids = [int_arg(i) for i in split_arg("indicator_ids")]
+    topics = split_arg("topics")
+    start, end = int_arg(request.args.get("start")), int_arg(request.args.get("end"))
+
+    rows_query = (
+        db.session.query(
+            Indicator.country_id,
+            Country.country_isoid,
+            Indicator.indicator_id,
+            IndicatorMeta.indicator_api_code,
+            Indicator.year,
+            cast(Indicator.indicator_value, Float),
+        )
+        .join(Country, Country.country_id == Indicator.country_id)
+        .join(IndicatorMeta, IndicatorMeta.indicator_id == Indicator.indicator_id)
+    )
+    if countries:
+        rows_query = rows_query.filter(
+            Indicator.country_id.in_(resolve_country_ids(countries))
+        )
     if indicator_ids:
-        ids_lst = indicator_ids.split(",")
-        indicators_query = indicators_query.filter(Indicator.indicator_id.in_(ids_lst))
+        rows_query = rows_query.filter(Indicator.indicator_id.in_(indicator_ids))
+    if topics:
+        rows_query = rows_query.filter(IndicatorMeta.indicator_topic.in_(topics))
+    if start is not None:
+        rows_query = rows_query.filter(Indicator.year >= start)
+    if end is not None:
+        rows_query = rows_query.filter(Indicator.year <= end)
+    # server-side cursor, EXPORT_BATCH_SIZE rows in memory at a time
+    rows_query = rows_query.order_by(
+        Indicator.country_id, Indicator.indicator_id, Indicator.year
+    ).yield_per(EXPORT_BATCH_SIZE)
+
+    gzip = "gzip" in request.accept_encodings
+    response = current_app.response_class(
+        stream_with_context(export_chunks(rows_query, export_format, gzip)),
+        mimetype=EXPORT_FORMATS[export_format],
+    )
+    if gzip:
+        response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    disposition = "attachment; filename=eed_export.{}".format(export_format)
+    response.headers["Content-Disposition"] = disposition
+    return response
 
-    years = [int(i.year) for i in indicators_query.distinct(Indicator.year).all()]
-    res_dict["years"] = years
-    years_num_dict: Dict[int, int] = {v: k for k, v in enumerate(years)}
 
-    indicators = indicators_query.all()
-    indicators_dict: DefaultDict[str, List[Any]] = defaultdict(
-        lambda: [None] * len(years)
+def blob_response(country_id_or_name, column, name):
+    """the bytes of a country blob column, with a content hash ETag and range support"""
+    (data,) = (
+        db.session.query(column)
+        .filter(Country.country_id == resolve_country_id(country_id_or_name))
+        .first_or_404(description='Country "{}" not found'.format(country_id_or_name))
     )
-    for ind in indicators:
-        year_index: int = years_num_dict[ind.year]
-        indicators_dict[ind.indicator_id][year_index] = float(ind.indicator_value)
-    res_dict["indicator_values"] = indicators_dict
+    if not data:
+        description = 'Country "{}" has no {}'.format(country_id_or_name, name)
+        abort(404, description=description)
+    data = bytes(data)
+    mimetype = image_mimetype(data)
+    response = current_app.response_class(data, mimetype=mimetype)
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    if mimetype == "image/svg+xml":
+        response.headers["Content-Security-Policy"] = SVG_CONTENT_SECURITY_POLICY
+    # revalidated with the ETag on every use, so that admin edits show up
+    response.add_etag()
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    response.accept_ranges = "bytes"
+    return response.make_conditional(
+        request, accept_ranges=True, complete_length=len(data)
+    )
+
+
+def image_mimetype(data):
+    """mimetype of an image from its first bytes"""
+    for signature, mimetype in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            if mimetype == "image/webp" and data[8:12] != b"WEBP":
+                continue
+            return mimetype
+    if b"<svg" in data[:1024]:
+        return "image/svg+xml"
+    return "application/octet-stream"
+
 
-    return res_dict
+def split_arg(name):
+    """values of a comma separated query arg, without duplicates"""
+    items = (item.strip() for item in request.args.get(name, "").split(","))
+    return list(dict.fromkeys(item for item in items if item))
+
+
+def int_arg(value):
+    """int of a query arg value, None if missing, 400 if not an int"""
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        abort(400, description='"{}" is not an integer'.format(value))
+
+
+def year_range_args():
+    """start and end query args, 400 if end is before start or the range is too wide"""
+    start, end = int_arg(request.args.get("start")), int_arg(request.args.get("end"))
+    if None not in (start, end):
+        if end < start:
+            abort(400, description="end ({}) is before start ({})".format(end, start))
+        if end - start >= MAX_YEAR_SPAN:
+            abort(
+                400,
+                description="start - end spans more than {} years".format(
+                    MAX_YEAR_SPAN
+                ),
+            )
+    return start, end
+
+
+def resolve_country_ids(countries_id_or_name):
+    """country ids of ids, names or iso codes, 404 for unknown countries"""
+    if not countries_id_or_name:
+        abort(400, description="countries is required")
+    return list(dict.fromkeys(resolve_country_id(c) for c in countries_id_or_name))
+
+
+def resolve_country_id(country_id_or_name):
+    """country id of an id, name or iso code, 404 for unknown countries
+
+    Resolved in memory; a country missing from the resolver (e.g. added since
+    it was built) is looked up in countryDB."""
+    country_id = country_resolver().resolve(country_id_or_name)
+    if country_id is None:
+        description = 'Country "{}" not found'.format(country_id_or_name)
+        (country_id,) = (
+            country_query_by_id_or_name(country_id_or_name)
+            .with_entities(Country.country_id)
+            .first_or_404(description=description)
+        )
+    return country_id
 
 
 def get_country_by_id_or_name(country_id_or_name):
     """helper function to get country by id or name or iso code"""
+    return Country.query.filter(
+        Country.country_id == resolve_country_id(country_id_or_name)
+    ).first_or_404(description='Country "{}" not found'.format(country_id_or_name))
+
+
+def country_query_by_id_or_name(country_id_or_name):
+    """query of the country with this id or exact name or iso code"""
     try:
         country_id = int(country_id_or_name)
-        country_query = Country.query.filter(Country.country_id == country_id)
     except ValueError:
-        country_query = Country.query.filter(
+        return Country.query.filter(
             or_(
                 Country.country_name == country_id_or_name,
                 Country.country_isoid == country_id_or_name,
             )
         )
-    return country_query.first_or_404(
-        description='Country "{}" not found'.format(country_id_or_name)
-    )
+    return Country.query.filter(Country.country_id == country_id)
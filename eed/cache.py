@@ -0,0 +1,111 @@
+"""Response cache of the /api blueprint, shared by all workers"""
+import os
+import time
+from functools import wraps
+
+from flask import current_app, request
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from eed.formats import JSON, accepted_mimetype
+from eed.models import DatasetGeneration, db
+from wbscript.cache import ResponseCache
+from wbscript.generation import BUMP_SQL
+
+API_CACHE_ENABLED = os.getenv("EED_API_CACHE", "1") == "1"
+API_CACHE_PATH = os.getenv(
+    "EED_API_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "eed", "api_responses.sqlite3"),
+)
+API_CACHE_MAX_BYTES = int(os.getenv("EED_API_CACHE_MAX_MB", "64")) * 1024 * 1024
+# seconds a worker trusts the dataset generation it read last
+GENERATION_TTL = float(os.getenv("EED_GENERATION_TTL", "1"))
+
+# entries never expire: they are keyed by generation, least recently used are evicted
+api_cache = ResponseCache(API_CACHE_PATH, ttl=0, max_bytes=API_CACHE_MAX_BYTES)
+
+_generation = {"value": None, "checked_at": float("-inf")}
+
+
+def current_generation():
+    """dataset generation, None when it can not be read"""
+    now = time.monotonic()
+    if now - _generation["checked_at"] < GENERATION_TTL:
+        return _generation["value"]
+    try:
+        generation = (
+            db.session.query(DatasetGeneration.generation)
+            .filter(DatasetGeneration.id == 1)
+            .scalar()
+        )
+    except SQLAlchemyError:
+        db.session.rollback()
+        generation = None
+    _generation.update(value=generation, checked_at=now)
+    return generation
+
+
+def bump_generation():
+    """start a new dataset generation after changing data outside of wbscript"""
+    generation = db.session.execute(text(BUMP_SQL)).scalar()
+    db.session.commit()
+    _generation.update(value=generation, checked_at=time.monotonic())
+    return generation
+
+
+def cache_params(list_args=()):
+    """query args as a dict, comma separated list_args are sorted and deduplicated"""
+    params = {}
+    for name, values in request.args.lists():
+        if name in list_args:
+            items = {item.strip() for value in values for item in value.split(",")}
+            values = sorted(item for item in items if item)
+        params[name] = ",".join(values)
+    return params
+
+
+def cached_response(list_args=()):
+    """Serve the JSON responses of a view from the api cache.
+
+    Responses are keyed by path, normalized query args and dataset generation,
+    and carry a strong ETag so that clients can revalidate them with a 304.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            generation = current_generation() if API_CACHE_ENABLED else None
+            # only the default JSON responses are cached
+            if generation is None or accepted_mimetype() != JSON:
+                response = current_app.make_response(view(*args, **kwargs))
+                return conditional(response, "BYPASS")
+
+            params = cache_params(list_args)
+            params["_generation"] = generation
+            key = ResponseCache.make_key(request.path, params)
+            payload = api_cache.get(key)
+            if payload is not None:
+                response = current_app.response_class(
+                    payload, mimetype="application/json"
+                )
+                return conditional(response, "HIT")
+
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and response.is_json:
+                api_cache.set(key, response.get_data(), request.full_path)
+            return conditional(response, "MISS")
+
+        return wrapper
+
+    return decorator
+
+
+def conditional(response, cache_status):
+    """add a strong ETag and answer 304 when the client already has it"""
+    response.headers["X-EED-Cache"] = cache_status
+    response.vary.add("Accept")
+    if response.status_code != 200:
+        return response
+    response.add_etag()
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
@@ -0,0 +1,49 @@
+"""Per-worker snapshot of the indicator catalog, rebuilt for every dataset generation"""
+import threading
+
+from sqlalchemy import exists
+
+from eed.cache import current_generation
+from eed.models import Indicator, IndicatorMeta, db
+
+_lock = threading.Lock()
+_snapshot = {"generation": None, "indicators": None}
+
+
+def build_indicator_catalog():
+    """details of the indicators which have data, keyed by indicator_id"""
+    rows = (
+        db.session.query(
+            IndicatorMeta.indicator_id,
+            IndicatorMeta.indicator_api_code,
+            IndicatorMeta.indicator_name,
+            IndicatorMeta.indicator_description,
+            IndicatorMeta.indicator_source,
+            IndicatorMeta.indicator_topic,
+        )
+        .filter(exists().where(Indicator.indicator_id == IndicatorMeta.indicator_id))
+        .order_by(IndicatorMeta.indicator_id)
+    )
+    return {
+        indicator_id: {
+            "api_code": api_code,
+            "name": name,
+            "description": description,
+            "source": source,
+            "topics": topic,
+        }
+        for indicator_id, api_code, name, description, source, topic in rows
+    }
+
+
+def indicator_catalog():
+    """indicator catalog of the current dataset generation, must not be modified"""
+    generation = current_generation()
+    if generation is None:
+        return build_indicator_catalog()
+    if _snapshot["generation"] != generation:
+        with _lock:
+            if _snapshot["generation"] != generation:
+                indicators = build_indicator_catalog()
+                _snapshot.update(indicators=indicators, generation=generation)
+    return _snapshot["indicators"]
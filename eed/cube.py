@@ -0,0 +1,102 @@
+"""Stats answered from the memory-mapped data cube of the current dataset generation"""
+import threading
+
+import numpy as np
+
+from eed.cache import current_generation
+from wbscript.cube import CUBE_ENABLED, open_cube
+
+_lock = threading.Lock()
+_mapped = {"generation": None, "cube": None}
+
+
+def current_cube():
+    """cube of the current generation, None when disabled or not published yet"""
+    if not CUBE_ENABLED:
+        return None
+    generation = current_generation()
+    if generation is None:
+        return None
+    if _mapped["generation"] != generation:
+        with _lock:
+            if _mapped["generation"] != generation:
+                cube = open_cube(generation)
+                if cube is None:
+                    return None
+                # requests still using the previous cube keep their mapping
+                _mapped.update(cube=cube, generation=generation)
+    return _mapped["cube"]
+
+
+def cube_country_stats(cube, country_id, indicator_ids=None):
+    """indicator keys, years and values of a country, like the pivot of its rows"""
+    indicator_keys = cube.indicator_ids
+    if indicator_ids:
+        indicator_keys = np.intersect1d(indicator_keys, indicator_ids)
+    values = cube.select([country_id], indicator_keys, cube.years)[0]
+    present = cube.select_present([country_id], indicator_keys, cube.years)[0]
+    rows, columns = present.any(axis=1), present.any(axis=0)
+    return indicator_keys[rows], cube.years[columns], values[rows][:, columns]
+
+
+def cube_stats(cube, country_ids, indicator_ids=None, start=None, end=None):
+    """indicator keys, years and country x indicator x year values, like a pivot of rows
+
+    Without indicator_ids, only the indicators with rows (NULL values included)
+    are kept; without both start and end, only the years with rows. start - end
+    is clamped to the years of the cube."""
+    indicator_keys = cube.indicator_ids
+    if indicator_ids is not None:
+        indicator_keys = np.asarray(indicator_ids, dtype=np.int64)
+    if None in (start, end):
+        years = cube.years_between(start, end)
+    else:
+        years = cube.years_between(start, end)
+        if len(years):
+            years = np.arange(years.min(), years.max() + 1)
+    values = cube.select(country_ids, indicator_keys, years)
+    present = cube.select_present(country_ids, indicator_keys, years)
+    if indicator_ids is None:
+        rows = present.any(axis=(0, 2))
+        indicator_keys, values = indicator_keys[rows], values[:, rows]
+    if None in (start, end):
+        columns = present.any(axis=(0, 1))
+        years, values = years[columns], values[:, :, columns]
+    return indicator_keys, years, values
+
+
+def cube_aggregate_stats(cube, member_ids, indicator_ids=None, start=None, end=None):
+    """(indicator_id, year, sum, avg, min, max, count, argmin, argmax country) rows
+
+    One row per (indicator, year) with rows, arg min/max break ties by country_id.
+    Groups whose values are all NULL have a count of 0 and None aggregates."""
+    member_ids = np.unique(np.asarray(member_ids, dtype=np.int64))
+    indicator_keys = cube.indicator_ids
+    if indicator_ids:
+        indicator_keys = np.intersect1d(indicator_keys, indicator_ids)
+    years = cube.years_between(start, end)
+    values = cube.select(member_ids, indicator_keys, years)
+    groups = np.nonzero(
+        cube.select_present(member_ids, indicator_keys, years).any(axis=0)
+    )
+
+    has_value = ~np.isnan(values)
+    counts = has_value.sum(axis=0)
+    sums = np.where(has_value, values, 0.0).sum(axis=0)
+    lowest = np.where(has_value, values, np.inf)
+    highest = np.where(has_value, values, -np.inf)
+    columns = (
+        indicator_keys[groups[0]],
+        years[groups[1]],
+        sums[groups],
+        sums[groups] / np.maximum(counts[groups], 1),
+        lowest.min(axis=0)[groups],
+        highest.max(axis=0)[groups],
+        counts[groups],
+        member_ids[lowest.argmin(axis=0)[groups]],
+        member_ids[highest.argmax(axis=0)[groups]],
+    )
+    rows = list(zip(*(column.tolist() for column in columns)))
+    # the NULL aggregates of SQL for the groups without values
+    nulls = (None,) * 4 + (0, None, None)
+    return [row if row[6] else row[:2] + nulls for row in rows]
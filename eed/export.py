@@ -0,0 +1,65 @@
+"""Streaming NDJSON / CSV encoders of the /api/export rows, optionally gzipped"""
+import csv
+import io
+import json
+import zlib
+
+EXPORT_COLUMNS = (
+    "country_id",
+    "country_isoid",
+    "indicator_id",
+    "indicator_api_code",
+    "year",
+    "value",
+)
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# rows encoded together before a chunk is sent
+ROWS_PER_CHUNK = 1000
+
+
+def encode_ndjson(rows):
+    """one json object per line"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(EXPORT_COLUMNS, row))))
+        if len(lines) >= ROWS_PER_CHUNK:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def encode_csv(rows):
+    """csv with a header line"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count >= ROWS_PER_CHUNK:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    yield buffer.getvalue()
+
+
+ENCODERS = {"ndjson": encode_ndjson, "csv": encode_csv}
+
+
+def gzip_chunks(chunks):
+    """gzip stream of the text chunks, flushed after every chunk"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield data
+    yield compressor.flush()
+
+
+def export_chunks(rows, export_format, gzip=False):
+    """encoded chunks of the rows, bytes if gzip else str"""
+    chunks = ENCODERS[export_format](rows)
+    return gzip_chunks(chunks) if gzip else chunks
@@ -0,0 +1,128 @@
+"""Content negotiation of the stats endpoints: JSON, Arrow IPC, MessagePack and NPY"""
+import io
+import json
+
+import numpy as np
+from flask import abort, current_app, request
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "application/json"
+ARROW = "application/vnd.apache.arrow.stream"
+MSGPACK = "application/x-msgpack"
+NPY = "application/x-npy"
+STATS_MIMETYPES = (JSON, NPY, ARROW, MSGPACK)
+
+
+def available_mimetypes():
+    """mimetypes the stats endpoints can answer with, JSON first"""
+    mimetypes = [JSON, NPY]
+    if pyarrow is not None:
+        mimetypes.append(ARROW)
+    if msgpack is not None:
+        mimetypes.append(MSGPACK)
+    return mimetypes
+
+
+def accepted_mimetype():
+    """best available mimetype of the Accept header, JSON when nothing matches
+
+    None when the header only accepts stats formats which are not available
+    (e.g. Arrow without pyarrow)."""
+    accept = request.accept_mimetypes
+    if not accept:
+        return JSON
+    mimetype = accept.best_match(available_mimetypes())
+    if mimetype is None and not all(
+        value in STATS_MIMETYPES for value, quality in accept if quality
+    ):
+        # text/plain, browser headers without */*, ... as before the binary formats
+        mimetype = JSON
+    return mimetype
+
+
+def stats_response(json_body, axes, values, **meta):
+    """Response of a stats view in the format negotiated with the Accept header.
+
+    json_body builds the default JSON body. The binary formats are built from
+    axes (name: keys, one per dimension of values) and the float64 values,
+    nan where missing; meta is added to every format.
+    """
+    mimetype = accepted_mimetype()
+    if mimetype is None:
+        abort(406, description="Available formats: " + ", ".join(available_mimetypes()))
+    if mimetype == JSON:
+        response = current_app.make_response(json_body())
+    else:
+        axes = {name: np.asarray(keys, dtype=np.int64) for name, keys in axes.items()}
+        if mimetype == NPY:
+            # the axes follow the values in the body, a header would outgrow
+            # the header limits of proxies on wide requests
+            response = current_app.response_class(
+                npy_bytes(values, *axes.values()), mimetype=NPY
+            )
+            response.headers["X-EED-Axes"] = ",".join(axes)
+            if meta:
+                response.headers["X-EED-Meta"] = json.dumps(meta)
+        elif mimetype == ARROW:
+            response = current_app.response_class(
+                arrow_bytes(axes, values, meta), mimetype=ARROW
+            )
+        else:
+            response = current_app.response_class(
+                msgpack_bytes(axes, values, meta), mimetype=MSGPACK
+            )
+    response.vary.add("Accept")
+    return response
+
+
+def npy_bytes(values, *axes):
+    """values in the .npy format (little endian float64), then one int64 .npy
+    array per axis; np.load of the body alone reads the values"""
+    buffer = io.BytesIO()
+    np.lib.format.write_array(buffer, np.ascontiguousarray(values, dtype="<f8"))
+    for keys in axes:
+        np.lib.format.write_array(buffer, np.ascontiguousarray(keys, dtype="<i8"))
+    return buffer.getvalue()
+
+
+def msgpack_bytes(axes, values, meta):
+    """map of the axes, the shape and the raw little endian float64 values"""
+    return msgpack.packb(
+        {
+            **meta,
+            "axes": {name: keys.tolist() for name, keys in axes.items()},
+            "shape": list(values.shape),
+            "dtype": "<f8",
+            "values": np.ascontiguousarray(values, dtype="<f8").data,
+        },
+        use_bin_type=True,
+    )
+
+
+def arrow_bytes(axes, values, meta):
+    """Arrow IPC stream of one row per cell: a column per axis and a value column
+
+    Missing values are nulls, the axes and meta are in the schema metadata."""
+    grids = np.meshgrid(*axes.values(), indexing="ij") if axes else []
+    columns = [pyarrow.array(grid.ravel()) for grid in grids]
+    # from_pandas turns nan into nulls, the values buffer itself is not copied
+    columns.append(pyarrow.array(values.ravel(), from_pandas=True))
+    table = pyarrow.Table.from_arrays(columns, names=list(axes) + ["value"])
+    axes_lists = {name: keys.tolist() for name, keys in axes.items()}
+    table = table.replace_schema_metadata(
+        {"eed.axes": json.dumps(axes_lists), "eed.meta": json.dumps(meta)}
+    )
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
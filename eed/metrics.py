@@ -0,0 +1,354 @@
+"""Per-route request, latency and SQL metrics, exposed at /metrics for Prometheus
+
+Every worker keeps its own counters and writes them to a file of EED_METRICS_DIR
+at most every EED_METRICS_FLUSH_INTERVAL seconds (and when it exits); /metrics sums
+the files, so any gunicorn worker can answer it. The files of exited workers are
+folded into dead.json, so the counters never decrease within a run. Each response
+also carries a Server-Timing header with its total and SQL time."""
+import atexit
+import contextlib
+import copy
+import fcntl
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+METRICS_ENABLED = os.getenv("EED_METRICS", "1") == "1"
+METRICS_DIR = os.getenv("EED_METRICS_DIR") or os.getenv(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "eed-metrics")
+)
+FLUSH_INTERVAL = float(os.getenv("EED_METRICS_FLUSH_INTERVAL", "1"))
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROMETHEUS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+# requests which matched no route share one label
+UNMATCHED_ROUTE = "<unmatched>"
+# counters of the workers which exited during this run
+DEAD_WORKERS_FILE = "dead.json"
+
+
+class WorkerMetrics:
+    """Counters of this process, reset in a forked process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._started = None
+        self._written = False
+        self._flushed_at = float("-inf")
+        self.routes = {}
+
+    def _check_pid(self):
+        # counters inherited from the parent process are its own
+        if self._pid != os.getpid():
+            self.routes = {}
+            self._pid = os.getpid()
+            self._started = process_started(self._pid)
+            self._written = False
+
+    def _route(self, route):
+        self._check_pid()
+        if route not in self.routes:
+            self.routes[route] = {
+                "requests": {},
+                "buckets": [0] * len(LATENCY_BUCKETS),
+                "seconds": 0.0,
+                "count": 0,
+                "sql_queries": 0,
+                "sql_seconds": 0.0,
+            }
+        return self.routes[route]
+
+    def observe(self, route, method, status, seconds, sql_queries, sql_seconds):
+        with self._lock:
+            metrics = self._route(route)
+            key = "{} {}".format(method, status)
+            metrics["requests"][key] = metrics["requests"].get(key, 0) + 1
+            for idx, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    metrics["buckets"][idx] += 1
+            metrics["seconds"] += seconds
+            metrics["count"] += 1
+            metrics["sql_queries"] += sql_queries
+            metrics["sql_seconds"] += sql_seconds
+
+    def flush(self, force=False):
+        """write the counters of this worker to its file, at most every interval"""
+        now = time.monotonic()
+        if not force and now - self._flushed_at < FLUSH_INTERVAL:
+            return
+        with self._lock:
+            self._check_pid()
+            self._flushed_at = now
+            snapshot = {"started": self._started, "routes": copy.deepcopy(self.routes)}
+            written = self._written
+        path = worker_path(os.getpid())
+        if written:
+            write_json(path, snapshot)
+        else:
+            # the file of an exited process of the same pid is folded first
+            with files_lock():
+                fold_dead_workers([path])
+                write_json(path, snapshot)
+        self._written = True
+
+    def flush_at_exit(self):
+        # the counters since the last flush, e.g. of a worker recycled by gunicorn
+        if self._pid != os.getpid():
+            return
+        try:
+            self.flush(force=True)
+        except OSError:
+            pass
+
+
+worker_metrics = WorkerMetrics()
+atexit.register(worker_metrics.flush_at_exit)
+
+
+def process_started(pid):
+    """start time of process pid, None when no such process is running
+
+    Read from /proc where there is one, so a reused pid has another start time;
+    elsewhere 0 for any running process."""
+    if os.path.isdir("/proc"):
+        try:
+            with open("/proc/{}/stat".format(pid)) as infile:
+                # starttime is the 22nd field, the 2nd (comm) may contain spaces
+                fields = infile.read().rpartition(")")[2].split()
+        except OSError:
+            return None
+        return int(fields[19])
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass
+    return 0
+
+
+def worker_path(pid):
+    return os.path.join(METRICS_DIR, "{}.json".format(pid))
+
+
+def worker_paths():
+    return glob.glob(os.path.join(METRICS_DIR, "[0-9]*.json"))
+
+
+def read_json(path):
+    """content of a json file, None if missing or unreadable"""
+    try:
+        with open(path) as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w") as outfile:
+        json.dump(data, outfile)
+    os.replace(tmp_path, path)
+
+
+@contextlib.contextmanager
+def files_lock():
+    """exclusive lock of METRICS_DIR across processes, to fold and read the files"""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    with open(os.path.join(METRICS_DIR, ".lock"), "a") as lock_file:
+        # released when the file is closed
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def fold_dead_workers(paths):
+    """add the worker files of paths whose process exited to dead.json, then remove them
+
+    A file is dead when no process of its pid runs, or when that process started
+    at another time than the writer (a reused pid). Call with files_lock held."""
+    dead_path = os.path.join(METRICS_DIR, DEAD_WORKERS_FILE)
+    dead = None
+    for path in paths:
+        worker = read_json(path)
+        if worker is None and not os.path.exists(path):
+            continue
+        pid = int(os.path.basename(path)[: -len(".json")])
+        if isinstance(worker, dict) and worker.get("started") is not None:
+            if worker["started"] == process_started(pid):
+                continue
+        if dead is None:
+            dead = read_json(dead_path) or {"routes": {}}
+        if isinstance(worker, dict):
+            merge_routes(dead["routes"], worker.get("routes", {}))
+        write_json(dead_path, dead)
+        os.remove(path)
+
+
+def mark_worker_dead(pid):
+    """fold the file of an exited worker, from the gunicorn child_exit hook"""
+    with files_lock():
+        fold_dead_workers([worker_path(pid)])
+
+
+def clear_metrics():
+    """remove the files of a previous run, before the workers of this one start"""
+    with files_lock():
+        for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+            os.remove(path)
+
+
+def all_routes():
+    """merged routes of the running and exited workers of this run"""
+    routes = {}
+    with files_lock():
+        fold_dead_workers(worker_paths())
+        for path in worker_paths() + [os.path.join(METRICS_DIR, DEAD_WORKERS_FILE)]:
+            worker = read_json(path)
+            if isinstance(worker, dict):
+                merge_routes(routes, worker.get("routes", {}))
+    return routes
+
+
+def setup_metrics(app):
+    """collect the metrics of app requests and serve them at /metrics"""
+    if not METRICS_ENABLED:
+        return
+    if not event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+    # request hooks rather than the request signals, which need blinker
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
+    # gunicorn.conf.py clears them once in the gunicorn master, before the
+    # workers start; any other server serves from this one process
+    if "gunicorn" not in os.getenv("SERVER_SOFTWARE", ""):
+        clear_metrics()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not conn.info.get("query_started"):
+        return
+    started = conn.info["query_started"].pop()
+    if has_request_context() and "sql_queries" in g:
+        g.sql_queries += 1
+        g.sql_seconds += time.perf_counter() - started
+
+
+def start_request():
+    g.request_started = time.perf_counter()
+    g.sql_queries = 0
+    g.sql_seconds = 0.0
+
+
+def finish_request(response):
+    if "request_started" not in g:
+        return response
+    seconds = time.perf_counter() - g.request_started
+    route = request.url_rule.rule if request.url_rule else UNMATCHED_ROUTE
+    worker_metrics.observe(
+        route,
+        request.method,
+        response.status_code,
+        seconds,
+        g.sql_queries,
+        g.sql_seconds,
+    )
+    # the SQL of streamed responses runs after this, it is not counted
+    response.headers.add(
+        "Server-Timing",
+        'app;dur={:.1f}, db;dur={:.1f};desc="{} queries"'.format(
+            seconds * 1000, g.sql_seconds * 1000, g.sql_queries
+        ),
+    )
+    try:
+        worker_metrics.flush()
+    except OSError as e:
+        current_app.logger.warning("metrics not written to %s: %s", METRICS_DIR, e)
+    return response
+
+
+def metrics_view():
+    """metrics of all the workers in the Prometheus text format"""
+    worker_metrics.flush(force=True)
+    return Response(render(all_routes()), content_type=PROMETHEUS_MIMETYPE)
+
+
+def merge_routes(total, routes):
+    """add the routes of a worker to total"""
+    for route, metrics in routes.items():
+        merge(total.setdefault(route, {}), metrics)
+
+
+def merge(total, metrics):
+    """add the counters of a worker to total"""
+    if not total:
+        total.update(copy.deepcopy(metrics))
+        return
+    for key, count in metrics["requests"].items():
+        total["requests"][key] = total["requests"].get(key, 0) + count
+    total["buckets"] = [a + b for a, b in zip(total["buckets"], metrics["buckets"])]
+    for name in ("seconds", "count", "sql_queries", "sql_seconds"):
+        total[name] += metrics[name]
+
+
+def label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render(routes):
+    """Prometheus text exposition of the merged routes"""
+    lines = [
+        "# HELP eed_http_requests_total Requests by route, method and status.",
+        "# TYPE eed_http_requests_total counter",
+    ]
+    for route, metrics in sorted(routes.items()):
+        for key, count in sorted(metrics["requests"].items()):
+            method, status = key.split(" ")
+            labels = 'route="{}",method="{}",status="{}"'.format(
+                label(route), method, status
+            )
+            lines.append("eed_http_requests_total{{{}}} {}".format(labels, count))
+
+    lines += [
+        "# HELP eed_http_request_duration_seconds Request latency by route.",
+        "# TYPE eed_http_request_duration_seconds histogram",
+    ]
+    for route, metrics in sorted(routes.items()):
+        name = "eed_http_request_duration_seconds"
+        route_label = 'route="{}"'.format(label(route))
+        for bound, count in zip(LATENCY_BUCKETS, metrics["buckets"]):
+            lines.append(
+                '{}_bucket{{{},le="{}"}} {}'.format(name, route_label, bound, count)
+            )
+        lines.append(
+            '{}_bucket{{{},le="+Inf"}} {}'.format(name, route_label, metrics["count"])
+        )
+        lines.append("{}_sum{{{}}} {}".format(name, route_label, metrics["seconds"]))
+        lines.append("{}_count{{{}}} {}".format(name, route_label, metrics["count"]))
+
+    for name, key, kind in (
+        ("eed_sql_queries_total", "sql_queries", "SQL queries"),
+        ("eed_sql_duration_seconds_total", "sql_seconds", "Seconds spent in SQL"),
+    ):
+        lines += [
+            "# HELP {} {} of the requests by route.".format(name, kind),
+            "# TYPE {} counter".format(name),
+        ]
+        for route, metrics in sorted(routes.items()):
+            lines.append(
+                '{}{{route="{}"}} {}'.format(name, label(route), metrics[key])
+            )
+    return "\n".join(lines) + "\n"
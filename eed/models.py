@@ -1,6 +1,16 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Integer, Column, String, Numeric, Date, LargeBinary, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    BigInteger,
+    Integer,
+    Column,
+    String,
+    Numeric,
+    Date,
+    DateTime,
+    LargeBinary,
+    ForeignKey,
+)
+from sqlalchemy.orm import deferred, relationship
 
 db = SQLAlchemy()
 
@@ -11,8 +21,9 @@ class Country(db.Model):
     country_id = Column(Integer, primary_key=True)
     country_name = Column(String)
     country_isoid = Column(String)
-    country_flag = Column(LargeBinary)
-    country_map = Column(LargeBinary)
+    # loaded on access only, served by /api/countries/<id>/flag and /map
+    country_flag = deferred(Column(LargeBinary))
+    country_map = deferred(Column(LargeBinary))
     country_description = Column(String)
     country_area = Column(Integer)
     country_language = Column(String)
@@ -37,8 +48,8 @@ class Country(db.Model):
         }
 
 
-class Indicator(db.Model):
-    __tablename__ = "indicatordb"
+class IndicatorMeta(db.Model):
+    __tablename__ = "indicatormetadb"
 
     indicator_id = Column(Integer, primary_key=True)
     indicator_api_code = Column(String)
@@ -46,11 +57,23 @@ class Indicator(db.Model):
     indicator_description = Column(String)
     indicator_source = Column(String)
     indicator_topic = Column(String)
+
+    def __str__(self):
+        return self.indicator_name
+
+
+class Indicator(db.Model):
+    __tablename__ = "indicatordb"
+
     country_id = Column(Integer, ForeignKey(Country.country_id), primary_key=True)
+    indicator_id = Column(
+        Integer, ForeignKey(IndicatorMeta.indicator_id), primary_key=True
+    )
     year = Column(Integer, primary_key=True)
-    indicator_value = Column(Numeric, primary_key=True)
+    indicator_value = Column(Numeric)
 
     country = relationship(lambda: Country, back_populates="indicators")
+    meta = relationship(lambda: IndicatorMeta)
 
 
 class Aggregate(db.Model):
@@ -63,3 +86,11 @@ class Aggregate(db.Model):
     country_id = Column(Integer, ForeignKey(Country.country_id))
 
     country = relationship(lambda: Country, back_populates="aggregations")
+
+
+class DatasetGeneration(db.Model):
+    __tablename__ = "datasetgenerationdb"
+
+    id = Column(Integer, primary_key=True)
+    generation = Column(BigInteger)
+    updated_at = Column(DateTime(timezone=True))
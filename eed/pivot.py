@@ -0,0 +1,52 @@
+"""Vectorized pivots of (key, ..., key, value) tuples with NumPy"""
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def pivot(
+    rows: Sequence[Tuple], axes: Sequence[Optional[Sequence[int]]] = (None, None)
+) -> Tuple[List[np.ndarray], np.ndarray]:
+    """Keys of every axis and the dense values array, nan where missing.
+
+    An axis given as a sequence of keys keeps that order, a None axis holds the
+    sorted keys present in rows. Rows with a key outside of a given axis are dropped.
+    """
+    # None values become nan
+    table = np.array(rows, dtype=np.float64).reshape(len(rows), len(axes) + 1)
+    keys = []
+    indexes = []
+    keep = np.ones(len(rows), dtype=bool)
+    for column, axis in enumerate(axes):
+        if axis is None:
+            axis_keys, index = np.unique(table[:, column], return_inverse=True)
+        else:
+            axis_keys = np.asarray(axis, dtype=np.float64)
+            order = np.argsort(axis_keys, kind="stable")
+            sorted_keys = axis_keys[order]
+            position = np.searchsorted(sorted_keys, table[:, column])
+            position = position.clip(0, max(len(axis_keys) - 1, 0))
+            if len(axis_keys):
+                keep &= sorted_keys[position] == table[:, column]
+                index = order[position]
+            else:
+                keep[:] = False
+                index = position
+        keys.append(axis_keys.astype(np.int64))
+        indexes.append(index)
+
+    values = np.full(tuple(len(axis_keys) for axis_keys in keys), np.nan)
+    values[tuple(index[keep] for index in indexes)] = table[keep, -1]
+    return keys, values
+
+
+def to_lists(values: np.ndarray) -> list:
+    """array as nested lists of floats, None where missing"""
+    objects = values.astype(object)
+    objects[np.isnan(values)] = None
+    return objects.tolist()
+
+
+def keyed_rows(keys: Iterable[int], matrix: np.ndarray) -> dict:
+    """{key: list of the row values} for every row of the matrix"""
+    return dict(zip((int(key) for key in keys), to_lists(matrix)))
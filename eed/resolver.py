@@ -0,0 +1,72 @@
+"""Per-worker country alias resolver, rebuilt for every dataset generation"""
+import re
+import threading
+import unicodedata
+
+from eed.cache import current_generation
+from eed.models import Country, db
+from wbscript.catalog import get_catalog
+
+_lock = threading.Lock()
+# key of the resolver built while the generation can not be read (no row yet)
+NO_GENERATION = "none"
+_snapshot = {"generation": None, "resolver": None}
+
+
+def normalize(alias):
+    """case, accent, space and punctuation insensitive form of an alias"""
+    text = unicodedata.normalize("NFKD", str(alias))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"[\W_]+", "", text.casefold())
+
+
+class CountryResolver:
+    """country_id by id, name, ISO2 or ISO3 code, from a map of normalized aliases"""
+
+    def __init__(self, countries):
+        self.ids = set()
+        self.aliases = {}
+        countries = list(countries)
+        # names and codes of countryDB win over the aliases of the catalog
+        for country_id, name, isoid in countries:
+            self.ids.add(country_id)
+            self.add_aliases(country_id, name, isoid)
+        catalog = get_catalog()
+        for country_id, name, isoid in countries:
+            record = catalog.country(isoid) or catalog.country(name)
+            if record is not None:
+                self.add_aliases(country_id, record.name, record.iso2, record.iso3)
+
+    def add_aliases(self, country_id, *aliases):
+        for alias in aliases:
+            if alias:
+                self.aliases.setdefault(normalize(alias), country_id)
+
+    def resolve(self, country_id_or_name):
+        """country_id, None if unknown"""
+        try:
+            country_id = int(country_id_or_name)
+        except ValueError:
+            return self.aliases.get(normalize(country_id_or_name))
+        return country_id if country_id in self.ids else None
+
+
+def build_resolver():
+    countries = db.session.query(
+        Country.country_id, Country.country_name, Country.country_isoid
+    )
+    return CountryResolver(countries)
+
+
+def country_resolver():
+    """resolver of the current dataset generation"""
+    generation = current_generation()
+    if generation is None:
+        # kept too: resolve_country_id looks up the countries it misses in countryDB
+        generation = NO_GENERATION
+    if _snapshot["generation"] != generation:
+        with _lock:
+            if _snapshot["generation"] != generation:
+                resolver = build_resolver()
+                _snapshot.update(resolver=resolver, generation=generation)
+    return _snapshot["resolver"]
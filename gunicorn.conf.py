@@ -0,0 +1,14 @@
+"""gunicorn settings, read by gunicorn from the directory it is started in"""
+from eed import metrics
+
+
+def on_starting(server):
+    # the counters of a previous run are not part of this one
+    if metrics.METRICS_ENABLED:
+        metrics.clear_metrics()
+
+
+def child_exit(server, worker):
+    # the counters of an exited worker keep counting in /metrics
+    if metrics.METRICS_ENABLED:
+        metrics.mark_worker_dead(worker.pid)
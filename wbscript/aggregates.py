@@ -0,0 +1,53 @@
+"""Materialized per-(aggregate, indicator, year) statistics in aggregateStatsDB"""
+
+# one statement computes every statistic of a group, arg min/max break ties by country_id
+# NULL values (admin edits can set them) are neither counted nor an arg min/max
+REFRESH_SQL = '''
+    INSERT INTO aggregateStatsDB (
+        aggregate_name, indicator_id, year,
+        value_sum, value_avg, value_min, value_max,
+        argmin_country_id, argmax_country_id, value_count
+    )
+    SELECT
+        a.aggregate_name, f.indicator_id, f.year,
+        SUM(f.indicator_value), AVG(f.indicator_value), MIN(f.indicator_value), MAX(f.indicator_value),
+        (array_agg(f.country_id ORDER BY f.indicator_value ASC, f.country_id)
+            FILTER (WHERE f.indicator_value IS NOT NULL))[1],
+        (array_agg(f.country_id ORDER BY f.indicator_value DESC, f.country_id)
+            FILTER (WHERE f.indicator_value IS NOT NULL))[1],
+        COUNT(f.indicator_value)
+    FROM indicatorDB f
+    JOIN (SELECT DISTINCT aggregate_name, country_id FROM aggregateDB) a ON a.country_id = f.country_id
+    WHERE {}
+    GROUP BY a.aggregate_name, f.indicator_id, f.year
+'''
+
+
+def refresh_aggregate_stats(con, aggregate_names=None, indicator_ids=None, years=None):
+    """Recompute the statistics of the given aggregates, indicators and (start, end) years.
+
+    None means all of them. The old rows are replaced in one transaction.
+    """
+    delete_conditions = ['TRUE']
+    select_conditions = ['TRUE']
+    params = []
+    if aggregate_names is not None:
+        delete_conditions.append('aggregate_name = ANY(%s)')
+        select_conditions.append('a.aggregate_name = ANY(%s)')
+        params.append(list(aggregate_names))
+    if indicator_ids is not None:
+        delete_conditions.append('indicator_id = ANY(%s)')
+        select_conditions.append('f.indicator_id = ANY(%s)')
+        params.append(list(indicator_ids))
+    if years is not None:
+        delete_conditions.append('year BETWEEN %s AND %s')
+        select_conditions.append('f.year BETWEEN %s AND %s')
+        params.extend(years)
+
+    with con:
+        with con.cursor() as cur:
+            cur.execute('DELETE FROM aggregateStatsDB WHERE {}'.format(' AND '.join(delete_conditions)), params)
+            cur.execute(REFRESH_SQL.format(' AND '.join(select_conditions)), params)
+            count = cur.rowcount
+    print('aggregateStatsDB: {} statistics refreshed'.format(count))
+    return count
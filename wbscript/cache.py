@@ -0,0 +1,134 @@
+"""Persistent on-disk cache of HTTP responses (sqlite, zlib-compressed payloads)"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+import zlib
+
+CACHE_PATH = os.getenv('EED_WB_CACHE_PATH', os.path.join(os.path.expanduser('~'), '.cache', 'eed', 'wb_responses.sqlite3'))
+CACHE_TTL = int(os.getenv('EED_WB_CACHE_TTL', str(24 * 60 * 60)))
+CACHE_MAX_BYTES = int(os.getenv('EED_WB_CACHE_MAX_MB', '512')) * 1024 * 1024
+
+
+class ResponseCache:
+    """Responses keyed by url and query parameters, expired after ttl seconds and
+    evicted least recently used first when the payloads exceed max_bytes.
+
+    Expired responses stay in the file (offline mode still serves them) until
+    they are evicted. The total size of the payloads is kept up to date by
+    triggers, so a write does not scan the table.
+    The sqlite file can be shared by several threads and processes.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._con = None
+        self._pid = None
+
+    @staticmethod
+    def make_key(url, params=None):
+        if params:
+            url = '{}?{}'.format(url, urllib.parse.urlencode(sorted((k, str(v)) for k, v in params.items())))
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def _connection(self):
+        # connections are not shared with forked processes
+        if self._con is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._con = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._con.execute('PRAGMA journal_mode=WAL')
+            self._con.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    url TEXT,
+                    payload BLOB,
+                    size INTEGER,
+                    created_at REAL,
+                    accessed_at REAL
+                )
+            ''')
+            self._con.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+            self._create_size_table(self._con)
+            self._pid = os.getpid()
+        return self._con
+
+    @staticmethod
+    def _create_size_table(con):
+        # total of the payload sizes, initialized from the responses of older cache files
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            con.execute('CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 1), total INTEGER)')
+            con.execute('INSERT OR IGNORE INTO cache_size SELECT 1, COALESCE(SUM(size), 0) FROM responses')
+            con.execute('''
+                CREATE TRIGGER IF NOT EXISTS responses_size_insert AFTER INSERT ON responses
+                BEGIN UPDATE cache_size SET total = total + new.size; END
+            ''')
+            con.execute('''
+                CREATE TRIGGER IF NOT EXISTS responses_size_update AFTER UPDATE OF size ON responses
+                BEGIN UPDATE cache_size SET total = total + new.size - old.size; END
+            ''')
+            con.execute('''
+                CREATE TRIGGER IF NOT EXISTS responses_size_delete AFTER DELETE ON responses
+                BEGIN UPDATE cache_size SET total = total - old.size; END
+            ''')
+            con.execute('COMMIT')
+        except sqlite3.Error:
+            con.execute('ROLLBACK')
+            raise
+
+    def get(self, key, ignore_ttl=False):
+        """payload stored under key, None if missing or expired"""
+        now = time.time()
+        with self._lock:
+            con = self._connection()
+            row = con.execute('SELECT payload, created_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None or (not ignore_ttl and self.ttl and row[1] < now - self.ttl):
+                self.misses += 1
+                return None
+            con.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+            self.hits += 1
+        return zlib.decompress(row[0])
+
+    def set(self, key, payload, url=None):
+        data = zlib.compress(payload)
+        now = time.time()
+        with self._lock:
+            con = self._connection()
+            # an upsert rather than INSERT OR REPLACE, whose implicit delete fires no trigger
+            con.execute('''
+                INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    url = excluded.url, payload = excluded.payload, size = excluded.size,
+                    created_at = excluded.created_at, accessed_at = excluded.accessed_at
+            ''', (key, url, data, len(data), now, now))
+            self._evict(con)
+
+    def _evict(self, con):
+        # only the size budget evicts, expired responses are kept for offline mode
+        total = con.execute('SELECT total FROM cache_size').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in con.execute('SELECT key, size FROM responses ORDER BY accessed_at'):
+            evicted.append((key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        con.executemany('DELETE FROM responses WHERE key = ?', evicted)
+
+    def size(self):
+        with self._lock:
+            return self._connection().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+
+    def clear(self):
+        with self._lock:
+            self._connection().execute('DELETE FROM responses')
@@ -0,0 +1,102 @@
+"""Indexed catalog of the countries and indicators listed in Mcountries.csv / Mindicators.csv"""
+import csv
+import os
+
+SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
+COUNTRIES_PATH = os.path.join(SCRIPT_PATH, 'Mcountries.csv')
+INDICATORS_PATH = os.path.join(SCRIPT_PATH, 'Mindicators.csv')
+
+
+class CountryRecord:
+    __slots__ = ('country_id', 'name', 'iso2', 'iso3', 'capital')
+
+    def __init__(self, country_id, name, iso2, iso3, capital=None):
+        self.country_id = country_id
+        self.name = name
+        self.iso2 = iso2
+        self.iso3 = iso3
+        self.capital = capital
+
+    def keys(self):
+        return self.country_id, str(self.country_id), self.name, self.iso2, self.iso3
+
+    def row(self):
+        """row as in Mcountries.csv"""
+        return [self.iso3, self.iso2, self.name, self.capital]
+
+
+class IndicatorRecord:
+    __slots__ = ('indicator_id', 'api_code', 'name', 'description', 'source', 'topic')
+
+    def __init__(self, indicator_id, api_code, name, description, source, topic):
+        self.indicator_id = indicator_id
+        self.api_code = api_code
+        self.name = name
+        self.description = description
+        self.source = source
+        self.topic = topic
+
+    def keys(self):
+        return self.indicator_id, str(self.indicator_id), self.api_code, self.name
+
+    def row(self):
+        """row as in Mindicators.csv"""
+        return [self.api_code, self.name, str(self.indicator_id), self.description, self.source, self.topic]
+
+
+class Catalog:
+    """Countries and indicators with hash indexes by id, name, ISO2/ISO3 and API code"""
+
+    def __init__(self, countries=(), indicators=()):
+        self.countries = []
+        self.indicators = []
+        self._countries_index = {}
+        self._indicators_index = {}
+        for record in countries:
+            self.add_country(record)
+        for record in indicators:
+            self.add_indicator(record)
+
+    @classmethod
+    def from_csv(cls, countries_path=COUNTRIES_PATH, indicators_path=INDICATORS_PATH):
+        with open(countries_path, newline='') as f:
+            rows = list(csv.reader(f))[1:]
+        # country ids are assigned by position in Mcountries.csv
+        countries = [CountryRecord(idx + 1, row[2], row[1], row[0], row[3]) for idx, row in enumerate(rows)]
+
+        with open(indicators_path, newline='') as f:
+            rows = list(csv.reader(f))[1:]
+        indicators = [IndicatorRecord(int(row[2]), row[0], row[1], row[3], row[4], row[5]) for row in rows]
+
+        return cls(countries, indicators)
+
+    def add_country(self, record):
+        self.countries.append(record)
+        for key in record.keys():
+            if key:
+                self._countries_index.setdefault(key, record)
+
+    def add_indicator(self, record):
+        self.indicators.append(record)
+        for key in record.keys():
+            if key:
+                self._indicators_index.setdefault(key, record)
+
+    def country(self, key):
+        """country by id, name, ISO2 or ISO3 code (None if unknown)"""
+        return self._countries_index.get(key)
+
+    def indicator(self, key):
+        """indicator by id, API code or name (None if unknown)"""
+        return self._indicators_index.get(key)
+
+
+_catalog = None
+
+
+def get_catalog():
+    """catalog loaded once from the csv files"""
+    global _catalog
+    if _catalog is None:
+        _catalog = Catalog.from_csv()
+    return _catalog
@@ -0,0 +1,148 @@
+"""Memory-mapped float64 cube of indicatorDB (country x indicator x year), published after a load"""
+import os
+import shutil
+
+import numpy as np
+
+CUBE_ENABLED = os.getenv('EED_CUBE', '0') == '1'
+CUBE_DIR = os.getenv('EED_CUBE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'eed', 'cube'))
+# older generations may still be mapped by workers which did not see the new one yet
+KEEP_GENERATIONS = 2
+FETCH_SIZE = 50000
+
+AXES = ('country_ids', 'indicator_ids', 'years')
+GENERATION_PREFIX = 'generation_'
+
+
+def generation_path(generation, cube_dir=CUBE_DIR):
+    return os.path.join(cube_dir, '{}{}'.format(GENERATION_PREFIX, generation))
+
+
+def publish_cube(con, generation, cube_dir=CUBE_DIR):
+    """Write the content of indicatorDB as the cube of generation.
+
+    The files are written in a temporary directory renamed into place, so
+    readers never see a partial cube. Missing cells are nan; present.npy marks
+    the cells with a row, so that rows with a NULL value are told apart.
+    """
+    path = generation_path(generation, cube_dir)
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    with con.cursor() as cur:
+        cur.execute('SELECT country_id FROM countryDB ORDER BY country_id')
+        country_ids = np.array([row[0] for row in cur], dtype=np.int64)
+        cur.execute('SELECT indicator_id FROM indicatorMetaDB ORDER BY indicator_id')
+        indicator_ids = np.array([row[0] for row in cur], dtype=np.int64)
+        cur.execute('SELECT MIN(year), MAX(year) FROM indicatorDB')
+        start_year, end_year = cur.fetchone()
+    if start_year is None:
+        years = np.empty(0, dtype=np.int64)
+    else:
+        years = np.arange(start_year, end_year + 1, dtype=np.int64)
+
+    values = np.lib.format.open_memmap(os.path.join(tmp_path, 'values.npy'), mode='w+', dtype='<f8',
+                                       shape=(len(country_ids), len(indicator_ids), len(years)))
+    values[:] = np.nan
+    present = np.lib.format.open_memmap(os.path.join(tmp_path, 'present.npy'), mode='w+', dtype=np.bool_,
+                                        shape=values.shape)
+    present[:] = False
+    # the foreign keys guarantee every row has a place in the axes
+    with con.cursor(name='eed_publish_cube') as cur:
+        cur.itersize = FETCH_SIZE
+        cur.execute('SELECT country_id, indicator_id, year, indicator_value::float8 FROM indicatorDB')
+        while True:
+            rows = cur.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            table = np.array(rows, dtype=np.float64)
+            cells = (np.searchsorted(country_ids, table[:, 0]),
+                     np.searchsorted(indicator_ids, table[:, 1]),
+                     (table[:, 2] - start_year).astype(np.int64))
+            values[cells] = table[:, 3]
+            present[cells] = True
+    con.rollback()
+    values.flush()
+    present.flush()
+    shape = values.shape
+    del values, present
+
+    for name, keys in zip(AXES, (country_ids, indicator_ids, years)):
+        np.save(os.path.join(tmp_path, name + '.npy'), keys)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+    prune_cubes(generation, cube_dir)
+    print('cube of generation {} published: {} countries x {} indicators x {} years'.format(generation, *shape))
+    return path
+
+
+def prune_cubes(generation, cube_dir=CUBE_DIR):
+    """remove the cubes older than the last KEEP_GENERATIONS generations"""
+    for name in os.listdir(cube_dir):
+        if not name.startswith(GENERATION_PREFIX):
+            continue
+        try:
+            old_generation = int(name[len(GENERATION_PREFIX):])
+        except ValueError:
+            # temporary directory of a publication which did not finish
+            continue
+        if old_generation <= generation - KEEP_GENERATIONS:
+            shutil.rmtree(os.path.join(cube_dir, name), ignore_errors=True)
+
+
+def open_cube(generation, cube_dir=CUBE_DIR):
+    """read-only Cube of generation, None if it was not published"""
+    path = generation_path(generation, cube_dir)
+    if not os.path.isdir(path):
+        return None
+    return Cube(path)
+
+
+class Cube:
+    """Published cube, the values are mapped read-only and only the pages read are loaded"""
+
+    def __init__(self, path):
+        self.path = path
+        self.values = np.load(os.path.join(path, 'values.npy'), mmap_mode='r')
+        present_path = os.path.join(path, 'present.npy')
+        # None in the cubes published before present.npy
+        self.present = np.load(present_path, mmap_mode='r') if os.path.exists(present_path) else None
+        self.country_ids, self.indicator_ids, self.years = (
+            np.load(os.path.join(path, name + '.npy')) for name in AXES)
+
+    @staticmethod
+    def index(axis_keys, keys):
+        """positions of keys in the sorted axis_keys, -1 for the keys missing"""
+        keys = np.asarray(keys, dtype=np.int64)
+        if not len(axis_keys):
+            return np.full(len(keys), -1, dtype=np.int64)
+        position = np.searchsorted(axis_keys, keys).clip(0, len(axis_keys) - 1)
+        return np.where(axis_keys[position] == keys, position, -1)
+
+    def select(self, country_ids, indicator_ids, years):
+        """dense country x indicator x year values of the keys, nan for the keys missing from the cube"""
+        return self._select(self.values, np.nan, country_ids, indicator_ids, years)
+
+    def select_present(self, country_ids, indicator_ids, years):
+        """dense country x indicator x year mask of the cells with a row, NULL value or not"""
+        if self.present is None:
+            return ~np.isnan(self.select(country_ids, indicator_ids, years))
+        return self._select(self.present, False, country_ids, indicator_ids, years)
+
+    def _select(self, array, missing, country_ids, indicator_ids, years):
+        indexes = [self.index(axis_keys, keys) for axis_keys, keys in
+                   zip((self.country_ids, self.indicator_ids, self.years), (country_ids, indicator_ids, years))]
+        selected = np.full(tuple(len(index) for index in indexes), missing, dtype=array.dtype)
+        found = [index >= 0 for index in indexes]
+        selected[np.ix_(*found)] = array[np.ix_(*(index[mask] for index, mask in zip(indexes, found)))]
+        return selected
+
+    def years_between(self, start=None, end=None):
+        years = self.years
+        if start is not None:
+            years = years[years >= start]
+        if end is not None:
+            years = years[years <= end]
+        return years
@@ -0,0 +1,135 @@
+"""Shared, thread-safe PostgreSQL connection pool for the wbscript helpers"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.pool import ThreadedConnectionPool
+
+# Configure by environment variables
+DB_NAME = os.getenv('EED_DB_NAME', 'test_worldbank')
+DB_HOST = os.getenv('EED_DB_HOST', 'localhost')
+DB_USER = os.getenv('EED_DB_USER', 'postgres')
+DB_PASS = os.getenv('EED_DB_PASS', 'postgres')
+POOL_MIN = int(os.getenv('EED_DB_POOL_MIN', '1'))
+POOL_MAX = int(os.getenv('EED_DB_POOL_MAX', '8'))
+
+# errors after which a connection can not be trusted anymore
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class PoolStats:
+    """Counters of a connection pool"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.discarded = 0
+        self.resets = 0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __str__(self):
+        return 'db pool: {} checkouts, {} in use (peak {}), {} waits ({:.3f}s), {} discarded, {} resets'.format(
+            self.checkouts, self.in_use, self.peak_in_use, self.waits, self.wait_seconds, self.discarded,
+            self.resets)
+
+
+class Pool:
+    """ThreadedConnectionPool which blocks when exhausted and is recreated after a fork.
+
+    psycopg2 raises PoolError when every connection is taken; here the caller
+    waits for one to be returned instead. A process forked from the one that
+    opened the connections gets a pool of its own, the parent's sockets are
+    left alone.
+    """
+
+    def __init__(self, minconn=POOL_MIN, maxconn=POOL_MAX, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.connect_kwargs = connect_kwargs or dict(dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST)
+        self.stats = PoolStats()
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._slots = None
+        # pools inherited from the parent process, kept referenced so their sockets are never closed here
+        self._inherited = []
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                if self._pool is not None:
+                    self._inherited.append(self._pool)
+                    self.stats.resets += 1
+                self._pool = ThreadedConnectionPool(self.minconn, self.maxconn, **self.connect_kwargs)
+                self._slots = threading.BoundedSemaphore(self.maxconn)
+                self._pid = os.getpid()
+            return self._pool, self._slots
+
+    @contextmanager
+    def connection(self, autocommit=True):
+        """Borrow a connection, returned to the pool when the block exits.
+
+        A transaction left open by the block is rolled back; a connection which
+        failed or was closed is discarded.
+        """
+        pool, slots = self._get_pool()
+        if not slots.acquire(blocking=False):
+            started = time.perf_counter()
+            slots.acquire()
+            with self._lock:
+                self.stats.waits += 1
+                self.stats.wait_seconds += time.perf_counter() - started
+        try:
+            con = pool.getconn()
+        except BaseException:
+            slots.release()
+            raise
+        with self._lock:
+            self.stats.checkouts += 1
+            self.stats.in_use += 1
+            self.stats.peak_in_use = max(self.stats.peak_in_use, self.stats.in_use)
+
+        discard = False
+        try:
+            con.autocommit = autocommit
+            yield con
+        except CONNECTION_ERRORS:
+            discard = True
+            raise
+        finally:
+            if not con.closed and not discard:
+                try:
+                    if con.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                        con.rollback()
+                except CONNECTION_ERRORS:
+                    discard = True
+            discard = discard or bool(con.closed)
+            pool.putconn(con, close=discard)
+            with self._lock:
+                self.stats.in_use -= 1
+                self.stats.discarded += discard
+            slots.release()
+
+    def close_all(self):
+        """close every connection of this process, e.g. before dropping the database"""
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.closeall()
+            self._pool = None
+            self._pid = None
+
+
+pool = Pool()
+
+
+def connection(autocommit=True):
+    """connection of the shared pool, see Pool.connection"""
+    return pool.connection(autocommit)
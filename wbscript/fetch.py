@@ -0,0 +1,199 @@
+"""Concurrent, chunked fetcher for the World Bank v2 API"""
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from wbscript.cache import ResponseCache
+
+API_URL = os.getenv('EED_WB_API_URL', 'https://api.worldbank.org/v2')
+MAX_WORKERS = int(os.getenv('EED_FETCH_WORKERS', '8'))
+PER_HOST = int(os.getenv('EED_FETCH_PER_HOST', '4'))
+COUNTRIES_PER_CHUNK = int(os.getenv('EED_FETCH_COUNTRIES_PER_CHUNK', '25'))
+RETRIES = int(os.getenv('EED_FETCH_RETRIES', '4'))
+BACKOFF = float(os.getenv('EED_FETCH_BACKOFF', '0.5'))
+TIMEOUT = float(os.getenv('EED_FETCH_TIMEOUT', '60'))
+OFFLINE = os.getenv('EED_WB_OFFLINE', '0') == '1'
+USE_CACHE = os.getenv('EED_WB_CACHE', '1') == '1'
+PER_PAGE = 1000
+
+# http statuses worth retrying, anything else fails the chunk immediately
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class FetchError(Exception):
+    """Request to the World Bank API failed"""
+
+
+class Chunk:
+    """One indicator for a group of countries, optionally for its own year range"""
+    __slots__ = ('indicator_code', 'countries', 'years')
+
+    def __init__(self, indicator_code, countries, years=None):
+        self.indicator_code = indicator_code
+        self.countries = tuple(countries)
+        self.years = years
+
+    def __repr__(self):
+        if self.years:
+            return 'Chunk({}, {}, {}:{})'.format(self.indicator_code, ';'.join(self.countries), *self.years)
+        return 'Chunk({}, {})'.format(self.indicator_code, ';'.join(self.countries))
+
+
+class ChunkResult:
+    """Rows (country code, year, value) of a chunk, or the error which failed it"""
+    __slots__ = ('chunk', 'rows', 'error')
+
+    def __init__(self, chunk, rows=None, error=None):
+        self.chunk = chunk
+        self.rows = rows or []
+        self.error = error
+
+
+def make_chunks(indicator_codes, countries, countries_per_chunk=COUNTRIES_PER_CHUNK, years=None):
+    countries = list(countries)
+    for code in indicator_codes:
+        for idx in range(0, len(countries), countries_per_chunk):
+            yield Chunk(code, countries[idx:idx + countries_per_chunk], years)
+
+
+def make_fetcher(offline=OFFLINE, use_cache=USE_CACHE):
+    """fetcher configured from the environment, offline mode always uses the cache"""
+    cache = ResponseCache() if use_cache or offline else None
+    return Fetcher(cache=cache, offline=offline)
+
+
+class Fetcher:
+    """Fetches indicator x country-group chunks on a bounded thread pool.
+
+    Requests to the same host are limited to per_host at a time, failed requests
+    are retried with exponential backoff, and a chunk that still fails is reported
+    in its ChunkResult instead of aborting the whole run.
+    """
+
+    def __init__(self, api_url=API_URL, max_workers=MAX_WORKERS, per_host=PER_HOST,
+                 retries=RETRIES, backoff=BACKOFF, timeout=TIMEOUT, cache=None, offline=False):
+        self.api_url = api_url.rstrip('/')
+        self.cache = cache
+        self.offline = offline
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._host_limits = {}
+        self._lock = threading.Lock()
+
+    def _host_limit(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_limits[host]
+
+    def _request(self, url):
+        with self._host_limit(url):
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                return response.read()
+
+    def get_json(self, url, params):
+        """GET url?params and parse the json, retrying transient failures.
+
+        Responses are served from and stored in the cache if there is one,
+        in offline mode only the cache is used.
+        """
+        url = '{}?{}'.format(url, urllib.parse.urlencode(sorted(params.items())))
+        key = ResponseCache.make_key(url) if self.cache is not None else None
+        if key is not None:
+            payload = self.cache.get(key, ignore_ttl=self.offline)
+            if payload is not None:
+                return self._parse(url, payload)
+        if self.offline:
+            raise FetchError('{}: not in cache (offline)'.format(url))
+
+        attempt = 0
+        while True:
+            try:
+                payload = self._request(url)
+                break
+            except urllib.error.HTTPError as e:
+                if e.code not in RETRY_STATUSES or attempt >= self.retries:
+                    raise FetchError('{}: HTTP {}'.format(url, e.code)) from e
+            except (urllib.error.URLError, OSError) as e:
+                if attempt >= self.retries:
+                    raise FetchError('{}: {}'.format(url, e)) from e
+            # exponential backoff with jitter
+            time.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+            attempt += 1
+
+        data = self._parse(url, payload)
+        if key is not None:
+            self.cache.set(key, payload, url)
+        return data
+
+    @staticmethod
+    def _parse(url, payload):
+        try:
+            data = json.loads(payload)
+        except ValueError as e:
+            raise FetchError('{}: invalid json'.format(url)) from e
+        if data and isinstance(data[0], dict) and 'message' in data[0]:
+            raise FetchError('{}: {}'.format(url, data[0]['message']))
+        return data
+
+    def fetch_chunk(self, chunk, start_year, end_year):
+        """all pages of a chunk as (country code, year, value) rows"""
+        if chunk.years:
+            start_year, end_year = chunk.years
+        url = '{}/country/{}/indicator/{}'.format(
+            self.api_url,
+            ';'.join(urllib.parse.quote(c) for c in chunk.countries),
+            urllib.parse.quote(chunk.indicator_code),
+        )
+        params = {'format': 'json', 'date': '{}:{}'.format(start_year, end_year), 'per_page': PER_PAGE}
+        rows = []
+        page = 1
+        while True:
+            params['page'] = page
+            data = self.get_json(url, params)
+            if len(data) < 2 or not data[1]:
+                break
+            for item in data[1]:
+                country = item.get('countryiso3code') or item['country']['id']
+                rows.append((country, int(item['date']), item['value']))
+            if page >= int(data[0].get('pages', 1)):
+                break
+            page += 1
+        return rows
+
+    def _run_chunk(self, chunk, start_year, end_year):
+        try:
+            return ChunkResult(chunk, rows=self.fetch_chunk(chunk, start_year, end_year))
+        except FetchError as e:
+            return ChunkResult(chunk, error=e)
+
+    def fetch(self, chunks, start_year, end_year):
+        """Generate a ChunkResult for every chunk as soon as it is fetched.
+
+        At most 2 * max_workers chunks are in flight, so results never pile up
+        faster than the consumer takes them.
+        """
+        chunks = iter(chunks)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = set()
+            while True:
+                while len(pending) < 2 * self.max_workers:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    pending.add(executor.submit(self._run_chunk, chunk, start_year, end_year))
+                if not pending:
+                    return
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
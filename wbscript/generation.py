@@ -0,0 +1,22 @@
+"""Dataset generation counter, bumped whenever the data served by the API changes"""
+
+# single row table, created by wbscript.migrations
+BUMP_SQL = '''
+    INSERT INTO datasetGenerationDB (id, generation, updated_at) VALUES (1, 1, now())
+    ON CONFLICT (id) DO UPDATE SET generation = datasetGenerationDB.generation + 1, updated_at = now()
+    RETURNING generation
+'''
+
+CURRENT_SQL = '''
+    SELECT generation FROM datasetGenerationDB WHERE id = 1
+'''
+
+
+def bump_generation(con):
+    """increment the dataset generation, cached API responses of older generations are not served anymore"""
+    with con:
+        with con.cursor() as cur:
+            cur.execute(BUMP_SQL)
+            generation = cur.fetchone()[0]
+    print('dataset generation', generation)
+    return generation
@@ -0,0 +1,223 @@
+"""Load jobs: state and progress of every load in loadJobDB, one load at a time cluster-wide"""
+import os
+import time
+
+import psycopg2
+
+from wbscript import db
+from wbscript.migrations import LOAD_JOB_TABLE
+
+# key of the session advisory lock held by the running load, the same in every process
+LOAD_LOCK_KEY = 4_201_001
+PROGRESS_INTERVAL = float(os.getenv('EED_JOB_PROGRESS_INTERVAL', '1'))
+# a queued job whose process did not take the lock within this delay is considered lost
+QUEUED_TIMEOUT = int(os.getenv('EED_JOB_QUEUED_TIMEOUT', '60'))
+
+ACTIVE_STATES = ('queued', 'running')
+
+JOB_FIELDS = ('job_id', 'state', 'stage', 'start_year', 'end_year', 'mode', 'rows_processed', 'rows_per_sec',
+              'chunks_done', 'chunks_total', 'eta_seconds', 'cancel_requested', 'error', 'pid', 'created_at',
+              'started_at', 'updated_at', 'finished_at')
+
+CREATE_SQL = '''
+    INSERT INTO loadJobDB (start_year, end_year, mode) VALUES (%s, %s, %s) RETURNING job_id
+'''
+
+SELECT_SQL = '''
+    SELECT {} FROM loadJobDB
+'''.format(', '.join(JOB_FIELDS))
+
+LOCK_HELD_SQL = '''
+    SELECT EXISTS (
+        SELECT 1 FROM pg_locks
+        WHERE locktype = 'advisory' AND granted AND classid = 0 AND objid = %s AND objsubid = 1
+          AND database = (SELECT oid FROM pg_database WHERE datname = current_database())
+    )
+'''
+
+PROGRESS_SQL = '''
+    UPDATE loadJobDB
+    SET stage = %s, rows_processed = %s, rows_per_sec = %s, chunks_done = %s, chunks_total = %s,
+        eta_seconds = %s, updated_at = now()
+    WHERE job_id = %s
+    RETURNING cancel_requested
+'''
+
+# jobs left active by a process which died, only run while holding the load lock
+INTERRUPTED_SQL = '''
+    UPDATE loadJobDB SET state = 'failed', error = 'interrupted', finished_at = now()
+    WHERE job_id IS DISTINCT FROM %s
+      AND (state = 'running' OR (state = 'queued' AND created_at < now() - %s * interval '1 second'))
+'''
+
+# the same, from processes which do not hold the load lock: only when no process holds it
+REAP_SQL = INTERRUPTED_SQL + '''
+      AND NOT ({})
+'''.format(LOCK_HELD_SQL)
+
+
+class JobCancelled(Exception):
+    """raised in the load when its job was cancelled"""
+
+
+def create_job(con, start_year, end_year, mode):
+    """queued job, returns its job_id"""
+    with con.cursor() as cur:
+        cur.execute(LOAD_JOB_TABLE)
+        cur.execute(CREATE_SQL, (start_year, end_year, mode))
+        return cur.fetchone()[0]
+
+
+def fetch_job(con, job_id=None):
+    """job as a dict, the latest one without job_id, None if there is none"""
+    try:
+        with con.cursor() as cur:
+            if job_id is None:
+                cur.execute(SELECT_SQL + ' ORDER BY job_id DESC LIMIT 1')
+            else:
+                cur.execute(SELECT_SQL + ' WHERE job_id = %s', (job_id,))
+            row = cur.fetchone()
+    except psycopg2.errors.UndefinedTable:
+        # no job was ever created in this database
+        con.rollback()
+        return None
+    return dict(zip(JOB_FIELDS, row)) if row else None
+
+
+def request_cancel(con, job_id):
+    """ask an active job to stop, the load checks it at its next progress update"""
+    with con.cursor() as cur:
+        cur.execute('''
+            UPDATE loadJobDB SET cancel_requested = TRUE, updated_at = now()
+            WHERE job_id = %s AND state IN %s
+        ''', (job_id, ACTIVE_STATES))
+        return cur.rowcount == 1
+
+
+def set_state(con, job_id, state, error=None):
+    with con.cursor() as cur:
+        cur.execute('''
+            UPDATE loadJobDB
+            SET state = %s, error = %s, updated_at = now(),
+                started_at = CASE WHEN %s = 'running' THEN now() ELSE started_at END,
+                finished_at = CASE WHEN %s IN %s THEN finished_at ELSE now() END,
+                pid = CASE WHEN %s = 'running' THEN %s ELSE pid END
+            WHERE job_id = %s
+        ''', (state, error, state, state, ACTIVE_STATES, state, os.getpid(), job_id))
+
+
+def load_running(con):
+    """True when a process of any host holds the load lock"""
+    with con.cursor() as cur:
+        cur.execute(LOCK_HELD_SQL, (LOAD_LOCK_KEY,))
+        return cur.fetchone()[0]
+
+
+def try_lock(con):
+    with con.cursor() as cur:
+        cur.execute('SELECT pg_try_advisory_lock(%s)', (LOAD_LOCK_KEY,))
+        return cur.fetchone()[0]
+
+
+def unlock(con):
+    with con.cursor() as cur:
+        cur.execute('SELECT pg_advisory_unlock(%s)', (LOAD_LOCK_KEY,))
+
+
+def fail_interrupted(con, job_id=None):
+    """mark failed the active jobs (other than job_id) whose process died, con must hold the load lock"""
+    with con.cursor() as cur:
+        cur.execute(INTERRUPTED_SQL, (job_id, QUEUED_TIMEOUT))
+        return cur.rowcount
+
+
+def reap_interrupted(con):
+    """fail_interrupted, when no load is running, without taking the load lock
+
+    Taking it here would make a job whose process is just starting fail with
+    "another load is running"; queued jobs are only reaped after QUEUED_TIMEOUT."""
+    with con.cursor() as cur:
+        cur.execute(REAP_SQL, (None, QUEUED_TIMEOUT, LOAD_LOCK_KEY))
+        return cur.rowcount
+
+
+class Progress:
+    """Progress of a load, does nothing; see JobProgress"""
+
+    def stage(self, name, chunks_total=None, cancellable=True):
+        pass
+
+    def chunk_done(self):
+        pass
+
+    def count(self, rows):
+        return rows
+
+
+class JobProgress(Progress):
+    """Progress of a load job, written to its row at most every interval seconds.
+
+    Every write also reads cancel_requested and raises JobCancelled when set,
+    so a cancelled load stops at its next chunk or batch of rows. From the first
+    stage started with cancellable=False (once the loaded rows are committed) a
+    cancel is no longer honored and the load runs to its end.
+    """
+
+    def __init__(self, job_id, interval=PROGRESS_INTERVAL):
+        self.job_id = job_id
+        self.interval = interval
+        self.name = None
+        self.rows = 0
+        self.rows_seconds = 0.0
+        self.chunks_done = 0
+        self.chunks_total = None
+        self.cancellable = True
+        self.stage_started = time.perf_counter()
+        self.flushed = 0.0
+
+    def stage(self, name, chunks_total=None, cancellable=True):
+        self.name = name
+        self.cancellable = self.cancellable and cancellable
+        self.chunks_done = 0
+        self.chunks_total = chunks_total
+        self.stage_started = time.perf_counter()
+        self.flush(force=True)
+
+    def chunk_done(self):
+        self.chunks_done += 1
+        self.flush()
+
+    def count(self, rows):
+        started = time.perf_counter() - self.rows_seconds
+        for row in rows:
+            self.rows += 1
+            if self.rows % 1000 == 0:
+                self.rows_seconds = time.perf_counter() - started
+                self.flush()
+            yield row
+        self.rows_seconds = time.perf_counter() - started
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.rows_seconds if self.rows_seconds else 0.0
+
+    @property
+    def eta_seconds(self):
+        # from the pace of the chunks of the current stage
+        if not self.chunks_total or not self.chunks_done:
+            return None
+        seconds = time.perf_counter() - self.stage_started
+        return seconds / self.chunks_done * (self.chunks_total - self.chunks_done)
+
+    def flush(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self.flushed < self.interval:
+            return
+        self.flushed = now
+        with db.connection() as con:
+            with con.cursor() as cur:
+                cur.execute(PROGRESS_SQL, (self.name, self.rows, self.rows_per_sec, self.chunks_done,
+                                           self.chunks_total, self.eta_seconds, self.job_id))
+                row = cur.fetchone()
+        if row and row[0] and self.cancellable:
+            raise JobCancelled('job {} cancelled'.format(self.job_id))
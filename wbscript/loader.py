@@ -0,0 +1,186 @@
+"""Bulk loading engine: streams rows into PostgreSQL with COPY FROM STDIN"""
+import datetime
+import io
+import itertools
+import json
+import os
+import time
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+BATCH_SIZE = int(os.getenv('EED_LOAD_BATCH_SIZE', '5000'))
+
+# errors caused by the content of a row: the batch is split to find the bad rows
+ROW_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError)
+
+
+class LoadStats:
+    """Counters of a bulk load"""
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.batches = 0
+        self.seconds = 0.0
+
+    @property
+    def rows_per_sec(self):
+        if not self.seconds:
+            return 0.0
+        return self.rows / self.seconds
+
+    def __str__(self):
+        return '{}: {} rows ({} inserted, {} updated, {} duplicates, {} rejected) in {} batches, {:.2f}s, {:.0f} rows/sec'.format(
+            self.table_name, self.rows, self.inserted, self.updated, self.duplicates, self.rejected,
+            self.batches, self.seconds, self.rows_per_sec)
+
+
+def copy_value(value):
+    """format a python value for the COPY text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\\\x' + bytes(value).hex()
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+def batches(rows, batch_size):
+    """split an iterable of rows into lists of batch_size rows"""
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def bulk_load(con, table_name, columns, rows, batch_size=BATCH_SIZE, method='copy', reject_path=None,
+              conflict_columns=None):
+    """Load rows (sequences of values ordered as columns) into table_name.
+
+    Every batch is loaded with COPY into a temporary staging table and moved into
+    the target table with INSERT ... ON CONFLICT DO NOTHING, so duplicate keys are
+    skipped as before. With conflict_columns the rows are upserted instead: existing
+    rows are updated, but only when one of their values actually changed.
+    A batch which fails because of bad rows is rolled back and split in halves until
+    the bad rows are isolated; those are written to reject_path.
+    One commit is made per batch. method='values' uses execute_values instead of COPY.
+    """
+    stats = LoadStats(table_name)
+    started = time.perf_counter()
+    con.autocommit = False
+    column_list = ', '.join(columns)
+
+    select_stage = 'SELECT {}'
+    on_conflict = 'ON CONFLICT DO NOTHING'
+    if conflict_columns:
+        value_columns = [column for column in columns if column not in conflict_columns]
+        # a row must not be upserted twice by the same statement
+        select_stage = 'SELECT DISTINCT ON ({}) {{}}'.format(', '.join(conflict_columns))
+        on_conflict = 'ON CONFLICT ({}) DO UPDATE SET {} WHERE ({}) IS DISTINCT FROM ({}) RETURNING (xmax = 0)'.format(
+            ', '.join(conflict_columns),
+            ', '.join('{0} = EXCLUDED.{0}'.format(column) for column in value_columns),
+            ', '.join('{}.{}'.format(table_name, column) for column in value_columns),
+            ', '.join('EXCLUDED.{}'.format(column) for column in value_columns),
+        )
+
+    if method == 'copy':
+        stage_name = '_stage_{}'.format(table_name.lower())
+        create_stage = '''
+            CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA
+        '''.format(stage_name, column_list, table_name)
+        try:
+            with con.cursor() as cur:
+                cur.execute(create_stage)
+        except psycopg2.ProgrammingError as e:
+            print(e)
+            print('COPY staging is not available, falling back to execute_values')
+            method = 'values'
+        con.rollback()
+
+    def load_batch(cur, batch):
+        if method == 'copy':
+            buffer = io.StringIO()
+            for row in batch:
+                buffer.write('\t'.join(copy_value(value) for value in row))
+                buffer.write('\n')
+            buffer.seek(0)
+            cur.execute(create_stage)
+            cur.copy_expert('COPY {} ({}) FROM STDIN'.format(stage_name, column_list), buffer)
+            cur.execute('''
+                INSERT INTO {} ({}) {} FROM {} {}
+            '''.format(table_name, column_list, select_stage.format(column_list), stage_name, on_conflict))
+            returned = cur.fetchall() if conflict_columns else None
+        else:
+            returned = execute_values(
+                cur,
+                'INSERT INTO {} ({}) VALUES %s {}'.format(table_name, column_list, on_conflict),
+                batch,
+                page_size=len(batch),
+                fetch=bool(conflict_columns),
+            )
+        if conflict_columns:
+            # one row per inserted or updated row, true when inserted
+            inserted = sum(1 for row in returned if row[0])
+            return inserted, len(returned) - inserted
+        return cur.rowcount, 0
+
+    rejects = []
+
+    def load_or_split(batch):
+        try:
+            with con.cursor() as cur:
+                inserted, updated = load_batch(cur, batch)
+            con.commit()
+        except ROW_ERRORS as e:
+            con.rollback()
+            if len(batch) == 1:
+                rejects.append((batch[0], e))
+                return
+            middle = len(batch) // 2
+            load_or_split(batch[:middle])
+            load_or_split(batch[middle:])
+            return
+        except psycopg2.ProgrammingError as e:
+            # not caused by a single row, splitting the batch would not help
+            con.rollback()
+            rejects.extend((row, e) for row in batch)
+            return
+        stats.inserted += inserted
+        stats.updated += updated
+        stats.duplicates += len(batch) - inserted - updated
+
+    for batch in batches(rows, batch_size):
+        stats.rows += len(batch)
+        stats.batches += 1
+        load_or_split(batch)
+        if rejects:
+            stats.rejected += len(rejects)
+            write_rejects(table_name, columns, rejects, reject_path)
+            rejects.clear()
+
+    stats.seconds = time.perf_counter() - started
+    return stats
+
+
+def write_rejects(table_name, columns, rejects, reject_path=None):
+    """print rejected rows and append them to reject_path as json lines"""
+    for row, error in rejects:
+        print('rejected {} row {}: {}'.format(table_name, tuple(row), str(error).strip()))
+    if reject_path is None:
+        return
+    with open(reject_path, 'a') as outfile:
+        for row, error in rejects:
+            json.dump({'row': dict(zip(columns, row)), 'error': str(error).strip()}, outfile, default=str)
+            outfile.write('\n')
@@ -0,0 +1,213 @@
+"""Idempotent schema upgrades for databases created by older versions of create_table"""
+import psycopg2
+import psycopg2.errors
+
+from wbscript.aggregates import REFRESH_SQL
+
+# indicator metadata dimension, one row per indicator
+INDICATOR_META_TABLE = '''
+    CREATE TABLE IF NOT EXISTS indicatorMetaDB (
+        indicator_id BIGINT PRIMARY KEY,
+        indicator_api_code VARCHAR,
+        indicator_name VARCHAR,
+        indicator_description VARCHAR,
+        indicator_source VARCHAR,
+        indicator_topic VARCHAR
+    )
+'''
+
+# narrow fact table, the primary key index covers the value for index-only scans
+INDICATOR_TABLE = '''
+    CREATE TABLE indicatorDB (
+        country_id INTEGER REFERENCES countryDB(country_id),
+        indicator_id BIGINT REFERENCES indicatorMetaDB(indicator_id),
+        year INT,
+        indicator_value DECIMAL,
+        CONSTRAINT indicatordb_pkey PRIMARY KEY (country_id, indicator_id, year) INCLUDE (indicator_value)
+    )
+'''
+
+# full refreshes are loaded here and swapped into indicatorDB once the load succeeded
+INDICATOR_STAGING_TABLE = '''
+    CREATE UNLOGGED TABLE indicatorDB_staging (
+        country_id INTEGER REFERENCES countryDB(country_id),
+        indicator_id BIGINT REFERENCES indicatorMetaDB(indicator_id),
+        year INT,
+        indicator_value DECIMAL,
+        PRIMARY KEY (country_id, indicator_id, year)
+    )
+'''
+
+INDICATOR_BY_INDICATOR_INDEX = '''
+    CREATE INDEX IF NOT EXISTS indicatordb_indicator_year ON indicatorDB (indicator_id, year)
+'''
+
+# statistics of the aggregates, refreshed by wbscript.aggregates.refresh_aggregate_stats
+AGGREGATE_STATS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS aggregateStatsDB (
+        aggregate_name VARCHAR,
+        indicator_id BIGINT,
+        year INT,
+        value_sum DECIMAL,
+        value_avg DECIMAL,
+        value_min DECIMAL,
+        value_max DECIMAL,
+        argmin_country_id INTEGER,
+        argmax_country_id INTEGER,
+        value_count INTEGER,
+        PRIMARY KEY (aggregate_name, indicator_id, year)
+    )
+'''
+
+# generation of the data served by the API, see wbscript.generation
+DATASET_GENERATION_TABLE = '''
+    CREATE TABLE IF NOT EXISTS datasetGenerationDB (
+        id INT PRIMARY KEY CHECK (id = 1),
+        generation BIGINT NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+'''
+
+# load jobs started from the admin, see wbscript.jobs (which creates it on older databases)
+LOAD_JOB_TABLE = '''
+    CREATE TABLE IF NOT EXISTS loadJobDB (
+        job_id SERIAL PRIMARY KEY,
+        state VARCHAR NOT NULL DEFAULT 'queued',
+        stage VARCHAR,
+        start_year INT,
+        end_year INT,
+        mode VARCHAR,
+        rows_processed BIGINT NOT NULL DEFAULT 0,
+        rows_per_sec DOUBLE PRECISION,
+        chunks_done INT NOT NULL DEFAULT 0,
+        chunks_total INT,
+        eta_seconds DOUBLE PRECISION,
+        cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+        error VARCHAR,
+        pid INT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        started_at TIMESTAMPTZ,
+        updated_at TIMESTAMPTZ,
+        finished_at TIMESTAMPTZ
+    )
+'''
+
+# year filter of the admin
+INDICATOR_BY_YEAR_INDEX = '''
+    CREATE INDEX IF NOT EXISTS indicatordb_year ON indicatorDB (year)
+'''
+
+# searches of the admin (ILIKE '%term%' on the names), only where pg_trgm is available
+TRIGRAM_INDEXES = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS countrydb_name_trgm ON countryDB USING gin (country_name gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS indicatormetadb_name_trgm ON indicatorMetaDB USING gin (indicator_name gin_trgm_ops)',
+]
+
+TRIGRAM_MIGRATION = 'trigram indexes of the country and indicator names'
+
+# (description, query returning true when the migration is needed, statements)
+MIGRATIONS = [
+    (
+        'unique (country_id, indicator_id, year) in indicatorDB',
+        '''SELECT to_regclass('indicatordb_cell_key') IS NULL AND to_regclass('indicatordb_pkey') IS NULL''',
+        [
+            '''
+                DELETE FROM indicatorDB a USING indicatorDB b
+                WHERE a.ctid < b.ctid
+                  AND a.country_id = b.country_id
+                  AND a.indicator_id = b.indicator_id
+                  AND a.year = b.year
+            ''',
+            '''
+                CREATE UNIQUE INDEX indicatordb_cell_key ON indicatorDB (country_id, indicator_id, year)
+            ''',
+        ],
+    ),
+    (
+        'split indicator metadata out of indicatorDB into indicatorMetaDB',
+        '''
+            SELECT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'indicatordb' AND column_name = 'indicator_name'
+            )
+        ''',
+        [
+            INDICATOR_META_TABLE,
+            '''
+                INSERT INTO indicatorMetaDB
+                SELECT DISTINCT ON (indicator_id)
+                    indicator_id, indicator_api_code, indicator_name, indicator_description,
+                    indicator_source, indicator_topic
+                FROM indicatorDB
+                WHERE indicator_id IS NOT NULL
+                ORDER BY indicator_id
+                ON CONFLICT DO NOTHING
+            ''',
+            'ALTER TABLE indicatorDB RENAME TO indicatorDB_old',
+            INDICATOR_TABLE,
+            '''
+                INSERT INTO indicatorDB (country_id, indicator_id, year, indicator_value)
+                SELECT DISTINCT ON (country_id, indicator_id, year)
+                    country_id, indicator_id, year, indicator_value
+                FROM indicatorDB_old
+                WHERE country_id IS NOT NULL AND indicator_id IS NOT NULL AND year IS NOT NULL
+            ''',
+            'DROP TABLE indicatorDB_old',
+            INDICATOR_BY_INDICATOR_INDEX,
+            'ANALYZE indicatorDB',
+        ],
+    ),
+    (
+        'materialized aggregate statistics in aggregateStatsDB',
+        '''SELECT to_regclass('aggregatestatsdb') IS NULL''',
+        [
+            AGGREGATE_STATS_TABLE,
+            REFRESH_SQL.format('TRUE'),
+        ],
+    ),
+    (
+        'dataset generation counter in datasetGenerationDB',
+        '''SELECT to_regclass('datasetgenerationdb') IS NULL''',
+        [
+            DATASET_GENERATION_TABLE,
+            "INSERT INTO datasetGenerationDB (id, generation) VALUES (1, 1) ON CONFLICT DO NOTHING",
+        ],
+    ),
+    (
+        'year index of indicatorDB',
+        '''SELECT to_regclass('indicatordb_year') IS NULL''',
+        [INDICATOR_BY_YEAR_INDEX],
+    ),
+    (
+        TRIGRAM_MIGRATION,
+        '''
+            SELECT to_regclass('indicatormetadb_name_trgm') IS NULL
+               AND EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm')
+        ''',
+        TRIGRAM_INDEXES,
+    ),
+]
+
+
+# skipped with a warning when the role may not apply them, e.g. CREATE EXTENSION as a non-superuser
+OPTIONAL_MIGRATIONS = {TRIGRAM_MIGRATION}
+OPTIONAL_MIGRATION_ERRORS = (psycopg2.errors.InsufficientPrivilege, psycopg2.errors.FeatureNotSupported)
+
+
+def migrate(con):
+    """apply the pending migrations, each one in its own transaction"""
+    for description, needed_sql, statements in MIGRATIONS:
+        try:
+            with con:
+                with con.cursor() as cur:
+                    cur.execute(needed_sql)
+                    if not cur.fetchone()[0]:
+                        continue
+                    print('migrating:', description)
+                    for sql in statements:
+                        cur.execute(sql)
+        except OPTIONAL_MIGRATION_ERRORS as e:
+            if description not in OPTIONAL_MIGRATIONS:
+                raise
+            print('skipped migration: {} ({})'.format(description, str(e).strip().splitlines()[0]))
@@ -0,0 +1,117 @@
+"""Parameterized, set-based statements for the wbscript retrieval functions.
+
+Year ranges use BETWEEN and groups of countries use = ANY(array), so a statement
+has the same text whatever the size of the range or the group. Every Query is
+executed as a server-side prepared statement, prepared once per connection.
+"""
+import weakref
+
+# names of the statements prepared on each connection
+_prepared = weakref.WeakKeyDictionary()
+
+
+class Query:
+    """Statement with %s placeholders, executed with PREPARE / EXECUTE"""
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        parts = sql.split('%s')
+        self.param_count = len(parts) - 1
+        # PREPARE takes $n placeholders
+        self.prepare_sql = parts[0] + ''.join('${}{}'.format(idx + 1, part) for idx, part in enumerate(parts[1:]))
+
+    def execute(self, cur, params):
+        names = _prepared.setdefault(cur.connection, set())
+        if self.name not in names:
+            cur.execute('PREPARE {} AS {}'.format(self.name, self.prepare_sql))
+            names.add(self.name)
+        if self.param_count:
+            cur.execute('EXECUTE {} ({})'.format(self.name, ', '.join(['%s'] * self.param_count)), params)
+        else:
+            cur.execute('EXECUTE {}'.format(self.name))
+
+
+def year_range(year):
+    """(start, end) of a year or a (start, end) tuple"""
+    if isinstance(year, tuple):
+        return int(year[0]), int(year[1])
+    return int(year), int(year)
+
+
+COUNTRY_FILTER = 'country_id = %s AND indicator_id = %s AND year BETWEEN %s AND %s'
+AGGREGATE_FILTER = 'country_id = ANY(%s) AND indicator_id = %s AND year BETWEEN %s AND %s'
+
+
+def _statistics(prefix, where):
+    """value and SUM/AVERAGE/MAX/MIN statements over the rows matching where"""
+    return {
+        None: Query(prefix + '_value', '''
+            SELECT indicator_value FROM indicatorDB WHERE {}
+        '''.format(where)),
+        'SUM': Query(prefix + '_sum', '''
+            SELECT SUM(indicator_value) AS sum_indicator_value FROM indicatorDB WHERE {}
+        '''.format(where)),
+        'AVERAGE': Query(prefix + '_average', '''
+            SELECT AVG(indicator_value) AS average_indicator_value FROM indicatorDB WHERE {}
+        '''.format(where)),
+        'MAX': Query(prefix + '_max', '''
+            WITH matching AS (SELECT * FROM indicatorDB WHERE {})
+            SELECT * FROM matching WHERE indicator_value = (SELECT MAX(indicator_value) FROM matching)
+        '''.format(where)),
+        'MIN': Query(prefix + '_min', '''
+            WITH matching AS (SELECT * FROM indicatorDB WHERE {})
+            SELECT * FROM matching WHERE indicator_value = (SELECT MIN(indicator_value) FROM matching)
+        '''.format(where)),
+    }
+
+
+COUNTRY_STATISTICS = _statistics('eed_country', COUNTRY_FILTER)
+AGGREGATE_STATISTICS = _statistics('eed_aggregate', AGGREGATE_FILTER)
+
+COUNTRY_ALL_INDICATORS = Query('eed_country_all_indicators', '''
+    SELECT indicator_value FROM indicatorDB WHERE country_id = %s AND year BETWEEN %s AND %s
+''')
+
+AGGREGATE_COUNTRIES = Query('eed_aggregate_countries', '''
+    SELECT country_id FROM aggregateDB WHERE aggregate_name = %s
+''')
+
+COUNTRY_AGGREGATES = Query('eed_country_aggregates', '''
+    SELECT * FROM aggregateDB WHERE country_id = %s
+''')
+
+AGGREGATE_STATS_FILTER = 'aggregate_name = %s AND indicator_id = %s AND year BETWEEN %s AND %s'
+
+AGGREGATE_STATS = {
+    'SUM': Query('eed_aggregate_stats_sum', '''
+        SELECT SUM(value_sum) AS sum_indicator_value FROM aggregateStatsDB WHERE {}
+    '''.format(AGGREGATE_STATS_FILTER)),
+    'AVERAGE': Query('eed_aggregate_stats_average', '''
+        SELECT SUM(value_sum) / NULLIF(SUM(value_count), 0) AS average_indicator_value
+        FROM aggregateStatsDB WHERE {}
+    '''.format(AGGREGATE_STATS_FILTER)),
+    'MAX': Query('eed_aggregate_stats_max', '''
+        SELECT argmax_country_id AS country_id, indicator_id, year, value_max AS indicator_value
+        FROM aggregateStatsDB WHERE {} AND value_max IS NOT NULL
+        ORDER BY value_max DESC, year LIMIT 1
+    '''.format(AGGREGATE_STATS_FILTER)),
+    'MIN': Query('eed_aggregate_stats_min', '''
+        SELECT argmin_country_id AS country_id, indicator_id, year, value_min AS indicator_value
+        FROM aggregateStatsDB WHERE {} AND value_min IS NOT NULL
+        ORDER BY value_min ASC, year LIMIT 1
+    '''.format(AGGREGATE_STATS_FILTER)),
+}
+
+# (indicator, country) pairs with missing cells or cells in the revision window
+DELTA_PLAN = Query('eed_delta_plan', '''
+    SELECT i.indicator_id, c.country_id, MIN(y.year) AS start_year, MAX(y.year) AS end_year
+    FROM unnest(%s::bigint[]) AS i(indicator_id)
+    CROSS JOIN unnest(%s::int[]) AS c(country_id)
+    CROSS JOIN generate_series(%s::int, %s::int) AS y(year)
+    WHERE y.year > %s OR NOT EXISTS (
+        SELECT 1 FROM indicatorDB f
+        WHERE f.country_id = c.country_id AND f.indicator_id = i.indicator_id AND f.year = y.year
+    )
+    GROUP BY i.indicator_id, c.country_id
+''')
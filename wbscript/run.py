@@ -1,39 +1,46 @@
-import csv
-import datetime
+import argparse
+import itertools
 import json
 import os
 import sys
+from collections import defaultdict
 
 import psycopg2
-import wbdata
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 
-# monkey patch for wbdata (update api to v2)
-wbdata.api.BASE_URL = '{}/v2'.format(wbdata.api.BASE_URL)
-wbdata.api.COUNTRIES_URL = "{0}/countries".format(wbdata.api.BASE_URL)
-wbdata.api.ILEVEL_URL = "{0}/incomeLevels".format(wbdata.api.BASE_URL)
-wbdata.api.INDICATOR_URL = "{0}/indicator".format(wbdata.api.BASE_URL)
-wbdata.api.LTYPE_URL = "{0}/lendingTypes".format(wbdata.api.BASE_URL)
-wbdata.api.SOURCES_URL = "{0}/sources".format(wbdata.api.BASE_URL)
-wbdata.api.TOPIC_URL = "{0}/topics".format(wbdata.api.BASE_URL)
+from wbscript import db, queries
+from wbscript.aggregates import refresh_aggregate_stats
+from wbscript.catalog import CountryRecord, get_catalog
+from wbscript.cube import CUBE_ENABLED, publish_cube
+from wbscript.fetch import OFFLINE, make_chunks, make_fetcher
+from wbscript.generation import bump_generation
+from wbscript.jobs import JobCancelled, JobProgress, Progress, fail_interrupted, set_state, try_lock, unlock
+from wbscript.loader import bulk_load
+from wbscript.migrations import (AGGREGATE_STATS_TABLE, DATASET_GENERATION_TABLE, INDICATOR_BY_INDICATOR_INDEX,
+                                 INDICATOR_BY_YEAR_INDEX, INDICATOR_META_TABLE, INDICATOR_STAGING_TABLE,
+                                 INDICATOR_TABLE, LOAD_JOB_TABLE, migrate)
 
 Country_table = []
 Indicator_table = []
 country_list = list()
 indicator_list = list()
-results = list()
-
-SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
 
 # Configure by environment variables
-DB_NAME = os.getenv('EED_DB_NAME', 'test_worldbank')
-DB_HOST = os.getenv('EED_DB_HOST', 'localhost')
-DB_USER = os.getenv('EED_DB_USER', 'postgres')
-DB_PASS = os.getenv('EED_DB_PASS', 'postgres')
+DB_NAME, DB_HOST, DB_USER, DB_PASS = db.DB_NAME, db.DB_HOST, db.DB_USER, db.DB_PASS
 
 START_YEAR = int(os.getenv('EED_START_YEAR', '2010'))
 END_YEAR = int(os.getenv('EED_END_YEAR', '2019'))
 
+REFRESH_MODES = ('full', 'delta')
+REFRESH_MODE = os.getenv('EED_REFRESH_MODE', 'full')
+REVISION_YEARS = int(os.getenv('EED_DELTA_REVISION_YEARS', '2'))
+
+INDICATOR_COLUMNS = ('indicator_id', 'country_id', 'year', 'indicator_value')
+INDICATOR_META_COLUMNS = ('indicator_id', 'indicator_api_code', 'indicator_name', 'indicator_description',
+                          'indicator_source', 'indicator_topic')
+INDICATOR_KEY = ('country_id', 'indicator_id', 'year')
+STAGING_TABLE = 'indicatorDB_staging'
+
 
 # Definition of the Indicator class
 class Indicator:
@@ -74,111 +81,260 @@ class Country:
 
 
 def country_translation(name):
-    for item in country_list:
-        for value in item.values():
-            if name == value:
-                return item['country_id']
+    country = get_catalog().country(name)
+    if country is not None:
+        return country.country_id
 
 
 def indicator_translation(name):
-    for item in indicator_list:
-        for value in item.values():
-            if name == value:
-                indicator_id = item['indicator_id']
-                indicator_api_code = item['indicator_api_code']
-                indicator_description = item['indicator_description']
-                indicator_source = item['indicator_source']
-                indicator_topic = item['indicator_topic']
-                return indicator_id, indicator_api_code, indicator_description, indicator_source, indicator_topic
+    indicator = get_catalog().indicator(name)
+    if indicator is not None:
+        return indicator.indicator_id, indicator.api_code, indicator.description, indicator.source, indicator.topic
 
 
 def init_dataset():
-    # create global Indicator_table from indicator.cfg
-    with open(os.path.join(SCRIPT_PATH, 'Mindicators.csv'), newline='') as f:
-        reader = csv.reader(f)
-        data = list(reader)
-        global Indicator_table
-        Indicator_table = data[1:]
-
-    # create global Country_table from indicator.cfg
-    with open(os.path.join(SCRIPT_PATH, 'Mcountries.csv'), newline='') as f:
-        reader = csv.reader(f)
-        data = list(reader)
-        global Country_table
-        Country_table = data[1:]
-
-    for idx, country in enumerate(Country_table):
-        country_dict = dict()  # country_dict must this format: {'country_id': '', 'country_name': '', 'country_ISOid': ''}
-        country_dict['country_id'] = idx + 1
-        country_dict['country_name'] = country[2]
-        country_dict['country_ISOid'] = country[1]
-        country_list.append(country_dict)
-
-    for indicator in Indicator_table:
+    catalog = get_catalog()
+
+    # create global Indicator_table and Country_table from the catalog (csv files)
+    global Indicator_table
+    Indicator_table = [indicator.row() for indicator in catalog.indicators]
+    global Country_table
+    Country_table = [country.row() for country in catalog.countries]
+
+    country_list.clear()
+    for country in catalog.countries:
+        country_list.append(country_dict(country))
+
+    indicator_list.clear()
+    for indicator in catalog.indicators:
         indicator_dict = dict()
         # indicator_dict must this format: {'indicator_id': '', 'indicator_api_code': '', 'indicator_name': '' , 'indicator_description': '', 'indicator_source' :'', 'indicator_topic' :''}
-        indicator_dict['indicator_id'] = indicator[2]
-        indicator_dict['indicator_api_code'] = indicator[0]
-        indicator_dict['indicator_name'] = indicator[1]
-        indicator_dict['indicator_description'] = indicator[3]
-        indicator_dict['indicator_source'] = indicator[4]
-        indicator_dict['indicator_topic'] = indicator[5]
+        indicator_dict['indicator_id'] = indicator.indicator_id
+        indicator_dict['indicator_api_code'] = indicator.api_code
+        indicator_dict['indicator_name'] = indicator.name
+        indicator_dict['indicator_description'] = indicator.description
+        indicator_dict['indicator_source'] = indicator.source
+        indicator_dict['indicator_topic'] = indicator.topic
         indicator_list.append(indicator_dict)
 
 
-def retrieve_external_data(start_year=START_YEAR, end_year=END_YEAR):
-    print('Getting data.......', start_year, '-', end_year)
-    data_date = (datetime.datetime(start_year, 1, 1), datetime.datetime(end_year, 1, 1))
-    indicators = dict()
-    for i in Indicator_table:
-        indicators[i[0]] = i[1]
-
-    countries = [country[0] for country in Country_table]
+def country_dict(country):
+    # country_dict must this format: {'country_id': '', 'country_name': '', 'country_ISOid': ''}
+    return {
+        'country_id': country.country_id,
+        'country_name': country.name,
+        'country_ISOid': country.iso2,
+    }
 
-    res = wbdata.get_dataframe(indicators, country=countries, data_date=data_date)
-    print("fetched...")
-    json_res = res.to_dict('index')
 
-    none_countries = []
-    for key, value in json_res.items():
-        country_id = country_translation(key[0])
-        if country_id is None:
-            none_countries.append(key)
+def fetch_chunks(chunks, start_year, end_year, failed_chunks, offline=OFFLINE, progress=Progress()):
+    # fetch indicator x country-group chunks concurrently, yielding them as they arrive
+    fetcher = make_fetcher(offline=offline)
+    for result in fetcher.fetch(chunks, start_year, end_year):
+        progress.chunk_done()
+        if result.error is not None:
+            print('fetch failed', result.chunk, result.error)
+            failed_chunks.append(result.chunk)
             continue
+        print('fetched', result.chunk)
+        yield result.chunk.indicator_code, result.rows
+
+
+def plan_delta(start_year, end_year, revision_years=REVISION_YEARS):
+    # (indicator, country) pairs which have missing cells or cells in the last
+    # revision_years years (recent values get revised upstream), with the years to fetch
+    indicator_ids = [get_catalog().indicator(indicator[0]).indicator_id for indicator in Indicator_table]
+    country_ids = [country_translation(country[0]) for country in Country_table]
+    return read_query(queries.DELTA_PLAN, (indicator_ids, country_ids, start_year, end_year, end_year - revision_years))
+
+
+def delta_chunks(plan):
+    # countries of an indicator which need the same years are fetched together
+    groups = defaultdict(list)
+    for item in plan:
+        indicator = get_catalog().indicator(item['indicator_id'])
+        country = get_catalog().country(item['country_id'])
+        groups[(indicator.api_code, item['start_year'], item['end_year'])].append(country.iso3)
+    for (indicator_code, start_year, end_year), countries in groups.items():
+        yield from make_chunks([indicator_code], countries, years=(start_year, end_year))
+
+
+def translate_chunks(chunks, none_countries):
+    for indicator_code, rows in chunks:
+        indicator = get_catalog().indicator(indicator_code)
+        for country_code, year, value in rows:
+            country_id = country_translation(country_code)
+            if country_id is None:
+                none_countries.add((country_code, year))
+                continue
+            # row ordered as INDICATOR_COLUMNS
+            yield indicator.indicator_id, country_id, year, value
+
+
+def clean_rows(rows):
+    for row in rows:
+        value = row[-1]
+        if value is None or str(value) == 'nan':
+            row = row[:-1] + (0,)
+        yield row
+
+
+def retrieve_external_data(start_year=START_YEAR, end_year=END_YEAR, offline=OFFLINE, mode=REFRESH_MODE,
+                           progress=Progress()):
+    print('Getting data.......', start_year, '-', end_year, '({} refresh)'.format(mode))
+    if mode not in REFRESH_MODES:
+        raise ValueError('unknown refresh mode {!r}, expected one of {}'.format(mode, REFRESH_MODES))
+
+    progress.stage('metadata')
+    insert_table('countryDB', country_list)
+    upgrade_schema()
+    load_rows('indicatorMetaDB', INDICATOR_META_COLUMNS,
+              (tuple(item[column] for column in INDICATOR_META_COLUMNS) for item in indicator_list),
+              conflict_columns=('indicator_id',))
+
+    if mode == 'delta':
+        # fetch only missing or stale cells and upsert them, unchanged rows are not touched
+        progress.stage('planning')
+        plan = plan_delta(start_year, end_year)
+        chunks = delta_chunks(plan)
+        conflict_columns = INDICATOR_KEY
+        refresh_scope = {
+            'indicator_ids': sorted({item['indicator_id'] for item in plan}),
+            'years': (min((item['start_year'] for item in plan), default=start_year),
+                      max((item['end_year'] for item in plan), default=end_year)),
+        }
+    else:
+        # loaded into a staging table, indicatorDB keeps its data until the load succeeded
+        create_staging()
+        indicator_codes = [indicator[0] for indicator in Indicator_table]
+        countries = [country[0] for country in Country_table]
+        chunks = make_chunks(indicator_codes, countries)
+        conflict_columns = None
+        refresh_scope = {}
+    target_table = 'indicatorDB' if mode == 'delta' else STAGING_TABLE
+
+    # fetch -> translate -> clean -> load, one chunk at a time
+    none_countries = set()
+    failed_chunks = []
+    chunks = list(chunks)
+    progress.stage('loading', chunks_total=len(chunks))
+    chunks = fetch_chunks(chunks, start_year, end_year, failed_chunks, offline, progress)
+    rows = progress.count(clean_rows(translate_chunks(chunks, none_countries)))
+    try:
+        load_rows(target_table, INDICATOR_COLUMNS, rows, conflict_columns)
+        if target_table == STAGING_TABLE:
+            swap_staging(failed_chunks)
+        else:
+            analyze_indicators()
+    finally:
+        if target_table == STAGING_TABLE:
+            drop_staging()
+    # the rows are committed: a cancel would leave the aggregates and the caches stale
+    progress.stage('aggregates', cancellable=False)
+    refresh_aggregates(**refresh_scope)
+    progress.stage('publishing', cancellable=False)
+    new_generation()
 
-        year = key[1]
-        for k, v in value.items():
-            indicator_dict = dict()  # {'indicator_id': '', 'indicator_api_code': '', 'indicator_name': '' , 'indicator_description': '', 'indicator_source' :'', 'indicator_topic' :''}
-            indicator_id, indicator_api_code, indicator_description, indicator_source, indicator_topic = indicator_translation(k)
-            indicator_dict['indicator_id'] = indicator_id
-            indicator_dict['country_id'] = country_id
-            indicator_dict['year'] = year
-            indicator_dict['indicator_name'] = k
-            indicator_dict['indicator_api_code'] = indicator_api_code
-            indicator_dict['indicator_description'] = indicator_description
-            indicator_dict['indicator_source'] = indicator_source
-            indicator_dict['indicator_topic'] = indicator_topic
-            indicator_dict['indicator_value'] = v
-            results.append(indicator_dict)
+    if failed_chunks:
+        print('{} chunks failed to fetch: {}'.format(len(failed_chunks), failed_chunks))
 
     # export json if countries is none
     with open('none_countries.json', 'w') as outfile:
-        json.dump(none_countries, outfile)
+        json.dump(sorted(none_countries), outfile)
 
-    insert_table('countryDB', country_list)
-    truncate_table('indicatorDB')
+    print("Data Loading FINISHED.")
+    print(db.pool.stats)
+
+
+def create_staging():
+    drop_staging()
+    with db.connection() as con:
+        with con.cursor() as cur:
+            cur.execute(INDICATOR_STAGING_TABLE)
+
+
+def drop_staging():
+    with db.connection() as con:
+        with con.cursor() as cur:
+            cur.execute('DROP TABLE IF EXISTS {}'.format(STAGING_TABLE))
+
+
+def swap_staging(failed_chunks=()):
+    # replace the content of indicatorDB with the staging table in one transaction,
+    # the (indicator, countries) of chunks which failed to fetch keep their former rows
+    with db.connection(autocommit=False) as con:
+        with con.cursor() as cur:
+            for chunk in failed_chunks:
+                country_ids = [country_translation(country) for country in chunk.countries]
+                cur.execute('''
+                    INSERT INTO {} (country_id, indicator_id, year, indicator_value)
+                    SELECT country_id, indicator_id, year, indicator_value FROM indicatorDB
+                    WHERE indicator_id = %s AND country_id = ANY(%s)
+                    ON CONFLICT DO NOTHING
+                '''.format(STAGING_TABLE), (get_catalog().indicator(chunk.indicator_code).indicator_id, country_ids))
+            cur.execute('TRUNCATE indicatorDB')
+            cur.execute('''
+                INSERT INTO indicatorDB (country_id, indicator_id, year, indicator_value)
+                SELECT country_id, indicator_id, year, indicator_value FROM {}
+            '''.format(STAGING_TABLE))
+            print('indicatorDB: {} rows swapped in from {}'.format(cur.rowcount, STAGING_TABLE))
+        con.commit()
+    analyze_indicators()
+
+
+def analyze_indicators():
+    # TRUNCATE resets the planner statistics, and autovacuum may only get to a bulk load later;
+    # the admin also shows the row count estimated from them
+    with db.connection() as con:
+        with con.cursor() as cur:
+            cur.execute('ANALYZE indicatorDB')
+
+
+def run_load_job(job_id, start_year=START_YEAR, end_year=END_YEAR, mode=REFRESH_MODE):
+    # run the load of a queued job of wbscript.jobs, unless another load holds the load lock
+    with db.connection() as lock_con:
+        if not try_lock(lock_con):
+            with db.connection() as con:
+                set_state(con, job_id, 'failed', error='another load is running')
+            print('load job', job_id, 'not started: another load is running')
+            return
+        try:
+            fail_interrupted(lock_con, job_id)
+            set_state(lock_con, job_id, 'running')
+            progress = JobProgress(job_id)
+            try:
+                init_dataset()
+                retrieve_external_data(start_year=start_year, end_year=end_year, mode=mode, progress=progress)
+            except JobCancelled:
+                set_state(lock_con, job_id, 'cancelled')
+                print('load job', job_id, 'cancelled')
+                return
+            except Exception as e:
+                set_state(lock_con, job_id, 'failed', error='{}: {}'.format(type(e).__name__, e))
+                raise
+            progress.flush(force=True)
+            set_state(lock_con, job_id, 'succeeded')
+        finally:
+            unlock(lock_con)
 
-    for result in results:
-        if result['indicator_value'] is None:
-            result['indicator_value'] = 0
-        if str(result['indicator_value']) == 'nan':
-            result['indicator_value'] = 0
 
-    with open('results.json', 'w') as outfile:
-        json.dump(results, outfile)
+def refresh_aggregates(aggregate_names=None, indicator_ids=None, years=None):
+    with db.connection(autocommit=False) as con:
+        refresh_aggregate_stats(con, aggregate_names, indicator_ids, years)
 
-    insert_table('indicatorDB', results)
-    print("Data Loading FINISHED.")
+
+def new_generation():
+    # invalidates the API response caches, and publishes the data cube of the new generation
+    with db.connection(autocommit=False) as con:
+        generation = bump_generation(con)
+        if CUBE_ENABLED:
+            publish_cube(con, generation)
+    return generation
+
+
+def upgrade_schema():
+    with db.connection(autocommit=False) as con:
+        migrate(con)
 
 
 def create_db():
@@ -198,9 +354,6 @@ def create_db():
 
 
 def create_table():
-    con = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST)
-    con.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-    cur = con.cursor()
     try:
         commands = [
             '''
@@ -217,19 +370,10 @@ def create_table():
                     country_next_election DATE
                 )
             ''',
-            '''
-                CREATE TABLE indicatorDB (
-                    indicator_id BIGINT,
-                    indicator_api_code VARCHAR,
-                    indicator_name VARCHAR,
-                    indicator_description VARCHAR,
-                    indicator_source VARCHAR,
-                    indicator_topic VARCHAR,
-                    country_id INTEGER REFERENCES countryDB(country_id),
-                    year INT,
-                    indicator_value DECIMAL
-                )
-            ''',
+            INDICATOR_META_TABLE,
+            INDICATOR_TABLE,
+            INDICATOR_BY_INDICATOR_INDEX,
+            INDICATOR_BY_YEAR_INDEX,
             '''
                CREATE TABLE aggregateDB (
                    aggregate_id SERIAL PRIMARY KEY,
@@ -240,101 +384,94 @@ def create_table():
                    country_id INTEGER REFERENCES countryDB(country_id)
                )
             ''',
+            AGGREGATE_STATS_TABLE,
+            DATASET_GENERATION_TABLE,
+            # the API caches snapshots by generation, there is one from the start
+            "INSERT INTO datasetGenerationDB (id, generation) VALUES (1, 1) ON CONFLICT DO NOTHING",
+            LOAD_JOB_TABLE,
         ]
-        for sql in commands:
-            cur.execute(sql)
-        cur.close()
-        con.commit()
+        with db.connection() as con:
+            with con.cursor() as cur:
+                for sql in commands:
+                    cur.execute(sql)
 
     except psycopg2.ProgrammingError as e:
         print(e)
-    finally:
-        if con is not None:
-            con.close()
 
 
 def truncate_table(table_name):
-    con = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST)
-    con.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-    cur = con.cursor()
     try:
-        sql = '''  truncate table {}  '''.format(table_name)
-        cur.execute(sql)
-        cur.close()
-        con.commit()
+        with db.connection() as con:
+            with con.cursor() as cur:
+                sql = '''  truncate table {}  '''.format(table_name)
+                cur.execute(sql)
 
     except psycopg2.ProgrammingError as e:
         print(e)
-    finally:
-        if con is not None:
-            con.close()
 
 
 def insert_table(table_name, list_data):
-    with psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST) as con:
-        con.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-        for item in list_data:
-            cur = con.cursor()
-            column_name = str(tuple(item.keys()))
-            value = tuple(item.values())
-
-            # formatting quote for db values
-            a = list(value)
-            for idx, i in enumerate(a):
-                if isinstance(i, str):
-                    i = i.replace("'", "''")
-                    a[idx] = i
-            value = str(tuple(a))
+    list_data = iter(list_data)
+    first = next(list_data, None)
+    if first is None:
+        return None
+    columns = tuple(first.keys())
+    rows = (tuple(item[column] for column in columns) for item in itertools.chain([first], list_data))
+    return load_rows(table_name, columns, rows)
 
-            try:
-                commands = [
-                    '''
-                        INSERT INTO {} {} VALUES {} ;
-                    '''.format(table_name, column_name.replace('\'', ''), value.replace('"', '\'')),
-                ]
-                for sql in commands:
-                    cur.execute(sql)
-                cur.close()
-                con.commit()
 
-            except psycopg2.ProgrammingError as e:
-                print(commands)
-                print(e)
+def load_rows(table_name, columns, rows, conflict_columns=None):
+    with db.connection(autocommit=False) as con:
+        stats = bulk_load(con, table_name, columns, rows, conflict_columns=conflict_columns,
+                          reject_path='{}_rejects.jsonl'.format(table_name.lower()))
+    print(stats)
+    return stats
 
-            except psycopg2.DataError as e:
-                print(commands)
-                print(e)
 
-            except psycopg2.IntegrityError as e:
-                if 'duplicate key value violates unique constraint' in str(e):
-                    print(commands)
-                    continue
+def read_table(commands, params=None):
+    datas = None
+    try:
+        with db.connection() as con:
+            with con.cursor() as cur:
+                cur.execute(commands, params)
+                datas = fetch_dicts(cur)
+
+    except psycopg2.ProgrammingError as e:
+        print(e)
 
+    return datas
 
-def read_table(commands):
-    con = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST)
-    con.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-    cur = con.cursor()
+
+def read_query(query, params):
+    # like read_table, for a queries.Query executed as a prepared statement
+    # pooled connections keep their prepared statements between calls
+    datas = None
     try:
-        cur.execute(commands)
-        records = cur.fetchall()
-        column_names = [row[0] for row in cur.description]
-        datas = list()
-        for record in records:
-            zipp = zip(column_names, record)
-            mapping = dict(map(list, zipp))
-            datas.append(mapping)
+        with db.connection() as con:
+            with con.cursor() as cur:
+                query.execute(cur, params)
+                datas = fetch_dicts(cur)
 
     except psycopg2.ProgrammingError as e:
         print(e)
-    finally:
-        if con is not None:
-            con.close()
 
     return datas
 
 
+def fetch_dicts(cur):
+    records = cur.fetchall()
+    column_names = [row[0] for row in cur.description]
+    datas = list()
+    for record in records:
+        zipp = zip(column_names, record)
+        mapping = dict(map(list, zipp))
+        datas.append(mapping)
+    return datas
+
+
 def drop_db():
+    # pooled connections would keep the database in use
+    db.pool.close_all()
     con = psycopg2.connect(dbname='postgres', user=DB_USER, password=DB_PASS, host=DB_HOST)
     con.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
     cur = con.cursor()
@@ -351,271 +488,62 @@ def drop_db():
 
 
 def retrievecountryfromsql(country=None, indicator=None, year=None, type_=None):
-    for c in Country_table:
-        for item in c:
-            if country == item:
-                characteristics = c
-
+    country_record = get_catalog().country(country)
+    characteristics = country_record.row() if country_record is not None else None
     country_id = country_translation(country)
 
     if indicator is None and year is None:
         print('{} characteristics: {}'.format(country, characteristics))
 
     if isinstance(indicator, str) and isinstance(year, int):
-        commands = ''' 
-            SELECT indicator_value FROM indicatorDB  
-            WHERE country_id = {} AND
-            indicator_id = {} AND
-            year = {}
-        '''.format(country_id, indicator, year)
-        datas = read_table(commands=commands)
+        datas = read_query(queries.COUNTRY_STATISTICS[None], (country_id, indicator, *queries.year_range(year)))
         return datas
 
     if isinstance(indicator, str) and isinstance(year, tuple):
-        start = int(year[0])
-        end = int(year[1])
-        year_range = [i for i in range(start, end+1)]
-
-        if type_ is None:
-            commands = ''' 
-                SELECT indicator_value FROM indicatorDB  
-                WHERE country_id = {} AND
-                indicator_id = {} AND (
-            '''.format(country_id, indicator)
-            for year in year_range:
-                commands += 'year = {} OR '.format(year)
-
-            commands = commands[:-3]+')'
-
-        elif type_ == 'SUM':
-            commands = ''' 
-                        SELECT SUM(indicator_value) as sum_indicator_value FROM indicatorDB  
-                        WHERE country_id = {} AND
-                        indicator_id = {} AND (
-                    '''.format(country_id, indicator)
-            for year in year_range:
-                commands += 'year = {} OR '.format(year)
-            commands = commands[:-3] + ')'
-
-        elif type_ == 'AVERAGE':
-            commands = ''' 
-                        SELECT AVG(indicator_value) as average_indicator_value FROM indicatorDB  
-                        WHERE country_id = {} AND
-                        indicator_id = {} AND (
-                    '''.format(country_id, indicator)
-            for year in year_range:
-                commands += 'year = {} OR '.format(year)
-            commands = commands[:-3] + ')'
-
-        elif type_ == 'MAX':
-            commands = ''' 
-                        SELECT * FROM indicatorDB WHERE indicator_value IN 
-                        (SELECT MAX(indicator_value) as max_indicator_value FROM indicatorDB  
-                        WHERE country_id = {} AND
-                        indicator_id = {} AND (
-                    '''.format(country_id, indicator)
-            for year in year_range:
-                commands += 'year = {} OR '.format(year)
-            commands = commands[:-3] + '))'
-
-        elif type_ == 'MIN':
-            commands = ''' 
-                        SELECT * FROM indicatorDB WHERE indicator_value IN 
-                        (SELECT MIN(indicator_value) as min_indicator_value FROM indicatorDB  
-                        WHERE country_id = {} AND
-                        indicator_id = {} AND (
-                    '''.format(country_id, indicator)
-            for year in year_range:
-                commands += 'year = {} OR '.format(year)
-            commands = commands[:-3] + '))'
-
-        datas = read_table(commands=commands)
-        return datas
-
-    if indicator is None and isinstance(year, int):
-        commands = ''' 
-                    SELECT indicator_value FROM indicatorDB  
-                    WHERE country_id = {} AND
-                    year = {}
-                '''.format(country_id, year)
-        datas = read_table(commands=commands)
+        datas = read_query(queries.COUNTRY_STATISTICS[type_], (country_id, indicator, *queries.year_range(year)))
         return datas
 
-    if indicator is None and isinstance(year, tuple):
-        start = int(year[0])
-        end = int(year[1])
-        year_range = [i for i in range(start, end + 1)]
-        commands = ''' 
-                    SELECT indicator_value FROM indicatorDB  
-                    WHERE country_id = {} AND (
-                '''.format(country_id, indicator)
-        for year in year_range:
-            commands += 'year = {} OR '.format(year)
-        commands = commands[:-3] + ')'
-
-        datas = read_table(commands=commands)
+    if indicator is None and isinstance(year, (int, tuple)):
+        datas = read_query(queries.COUNTRY_ALL_INDICATORS, (country_id, *queries.year_range(year)))
         return datas
 
 
 def delete_country(country_id):
-    con = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST)
-    con.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-    cur = con.cursor()
+    aggregate_names = [item['aggregate_name'] for item in country_id_in_aggregate_checker(country_id)]
     try:
-        sql = '''delete from aggregatedb where country_id = {}'''.format(country_id)
-        cur.execute(sql)
-        sql = '''delete from indicatordb where country_id = {}'''.format(country_id)
-        cur.execute(sql)
-        sql = '''delete from countrydb where country_id = {}'''.format(country_id)
-        cur.execute(sql)
-        cur.close()
-        con.commit()
+        with db.connection() as con:
+            with con.cursor() as cur:
+                cur.execute('''delete from aggregatedb where country_id = %s''', (country_id,))
+                cur.execute('''delete from indicatordb where country_id = %s''', (country_id,))
+                cur.execute('''delete from countrydb where country_id = %s''', (country_id,))
 
         print('country deleted')
 
     except psycopg2.ProgrammingError as e:
         print(e)
-    finally:
-        if con is not None:
-            con.close()
 
+    if aggregate_names:
+        refresh_aggregates(aggregate_names=aggregate_names)
+    new_generation()
 
-def retrieveaggregatefromsql(aggregate=list, indicators=None, year=None, type_=None):
 
-    # if indicators = 1 and year = 1
-    if isinstance(indicators, str) and isinstance(year, int):
+def retrieveaggregatefromsql(aggregate=list, indicators=None, year=None, type_=None):
+    # statistics of an arbitrary group of country ids, computed on the fly
+    if isinstance(indicators, str) and isinstance(year, (int, tuple)) and type_ in queries.AGGREGATE_STATISTICS:
         indicator_id, indicator_api_code, indicator_description, indicator_source, indicator_topic = indicator_translation(indicators)
+        datas = read_query(queries.AGGREGATE_STATISTICS[type_],
+                           (list(aggregate), indicator_id, *queries.year_range(year)))
+        return datas
 
-        if type_ == 'SUM':
-            commands = '''
-                        SELECT SUM(indicator_value) as sum_indicator_value FROM indicatorDB
-                        WHERE year = {} AND
-                        indicator_id = {} AND (
-                    '''.format(year, indicator_id)
-            for c in aggregate:
-                commands += 'country_id = {} OR '.format(c)
-            commands = commands[:-3] + ')'
-            datas = read_table(commands=commands)
-            return datas
-
-        elif type_ == 'AVERAGE':
-            commands = '''
-                        SELECT AVG(indicator_value) as average_indicator_value FROM indicatorDB
-                        WHERE year = {} AND
-                        indicator_id = {} AND (
-                    '''.format(year, indicator_id)
-            for c in aggregate:
-                commands += 'country_id = {} OR '.format(c)
-            commands = commands[:-3] + ')'
-            datas = read_table(commands=commands)
-            return datas
-
-        elif type_ == 'MAX':
-            commands = '''
-                        SELECT * FROM indicatorDB WHERE indicator_value IN 
-                        (SELECT MAX(indicator_value) as max_indicator_value FROM indicatorDB
-                        WHERE year = {} AND
-                        indicator_id = {} AND (
-                    '''.format(year, indicator_id)
-            for c in aggregate:
-                commands += 'country_id = {} OR '.format(c)
-            commands = commands[:-3] + '))'
-            datas = read_table(commands=commands)
-            return datas
-
-        elif type_ == 'MIN':
-            commands = '''
-                        SELECT * FROM indicatorDB WHERE indicator_value IN 
-                        (SELECT MIN(indicator_value) as min_indicator_value FROM indicatorDB
-                        WHERE year = {} AND
-                        indicator_id = {} AND (
-                    '''.format(year, indicator_id)
-            for c in aggregate:
-                commands += 'country_id = {} OR '.format(c)
-            commands = commands[:-3] + '))'
-            datas = read_table(commands=commands)
-            return datas
-
-    if isinstance(indicators, str) and isinstance(year, tuple):
-        indicator_id, indicator_api_code, indicator_description, indicator_source, indicator_topic = indicator_translation(indicators)
 
-        if type_ == 'SUM':
-            commands = '''
-                        SELECT SUM(indicator_value) as sum_indicator_value FROM indicatorDB
-                        WHERE indicator_id = {} AND (
-                    '''.format(indicator_id)
-            for c in aggregate:
-                commands += 'country_id = {} OR '.format(c)
-            commands = commands[:-3] + ')  AND ('
-
-            start = int(year[0])
-            end = int(year[1])
-            year_range = [i for i in range(start, end + 1)]
-            for y in year_range:
-                commands += 'year = {} OR '.format(y)
-            commands = commands[:-3] + ')'
-
-            datas = read_table(commands=commands)
-            return datas
-
-        elif type_ == 'AVERAGE':
-            commands = '''
-                        SELECT AVG(indicator_value) as average_indicator_value FROM indicatorDB
-                        WHERE indicator_id = {} AND (
-                    '''.format(indicator_id)
-            for c in aggregate:
-                commands += 'country_id = {} OR '.format(c)
-            commands = commands[:-3] + ')  AND ('
-
-            start = int(year[0])
-            end = int(year[1])
-            year_range = [i for i in range(start, end + 1)]
-            for y in year_range:
-                commands += 'year = {} OR '.format(y)
-            commands = commands[:-3] + ')'
-
-            datas = read_table(commands=commands)
-            return datas
-
-        elif type_ == 'MAX':
-            commands = '''
-                        SELECT * FROM indicatorDB WHERE indicator_value IN 
-                        (SELECT MAX(indicator_value) as max_indicator_value FROM indicatorDB
-                        WHERE indicator_id = {} AND (
-                    '''.format(indicator_id)
-            for c in aggregate:
-                commands += 'country_id = {} OR '.format(c)
-            commands = commands[:-3] + ')  AND ('
-
-            start = int(year[0])
-            end = int(year[1])
-            year_range = [i for i in range(start, end + 1)]
-            for y in year_range:
-                commands += 'year = {} OR '.format(y)
-            commands = commands[:-3] + '))'
-
-            datas = read_table(commands=commands)
-            return datas
-
-        elif type_ == 'MIN':
-            commands = '''
-                            SELECT * FROM indicatorDB WHERE indicator_value IN 
-                            (SELECT MIN(indicator_value) as min_indicator_value FROM indicatorDB
-                            WHERE indicator_id = {} AND (
-                        '''.format(indicator_id)
-            for c in aggregate:
-                commands += 'country_id = {} OR '.format(c)
-            commands = commands[:-3] + ')  AND ('
-
-            start = int(year[0])
-            end = int(year[1])
-            year_range = [i for i in range(start, end + 1)]
-            for y in year_range:
-                commands += 'year = {} OR '.format(y)
-            commands = commands[:-3] + '))'
-
-            datas = read_table(commands=commands)
-            return datas
+def retrieveaggregatestats(aggregate, indicators=None, year=None, type_=None):
+    # statistics of a named aggregate, read from the materialized aggregateStatsDB
+    if type_ not in queries.AGGREGATE_STATS:
+        raise ValueError('unknown type_ {!r}'.format(type_))
+    indicator_id = indicator_translation(indicators)[0]
+    datas = read_query(queries.AGGREGATE_STATS[type_], (aggregate, indicator_id, *queries.year_range(year)))
+    return datas
+
 
 def show_country_data():
     # sample indicator parameter
@@ -672,73 +600,63 @@ def show_country_data():
 def show_aggregate_data():
     indicators = ['Population ages 0-4, female (% of female population)', 'Population ages 0-14, female']
 
-    coutries = get_countries_from_aggregate('Africa')
-    coutries_id = []
-    for c in coutries:
-        coutries_id.append(c['country_id'])
-
     # 'For an aggregate, and for one indicator, retrieve the sum of all the indicator_value (for a specific year)'
     print('For an aggregate, and for one indicator, retrieve the sum of all the indicator_value (for a specific year)')
-    sum = retrieveaggregatefromsql(aggregate=coutries_id, indicators=indicators[0], year=2010, type_='SUM')
+    sum = retrieveaggregatestats(aggregate='Africa', indicators=indicators[0], year=2010, type_='SUM')
     print(sum)
     print('===========================================')
 
     # For an aggregate, and for one indicator, retrieve the sum of all the indicator_value (for a years range)
     print('For an aggregate, and for one indicator, retrieve the sum of all the indicator_value (for a years range)')
-    sum = retrieveaggregatefromsql(aggregate=coutries_id, indicators=indicators[0], year=(2010, 2012), type_='SUM')
+    sum = retrieveaggregatestats(aggregate='Africa', indicators=indicators[0], year=(2010, 2012), type_='SUM')
     print(sum)
     print('===========================================')
 
     # 'For an aggregate, and for one indicator, retrieve the sum of all the indicator_value (for a specific year)'
     print(
         'For an aggregate, and for one indicator, retrieve the average of all the indicator_value (for a specific year)')
-    avg = retrieveaggregatefromsql(aggregate=coutries_id, indicators=indicators[0], year=2010, type_='AVERAGE')
+    avg = retrieveaggregatestats(aggregate='Africa', indicators=indicators[0], year=2010, type_='AVERAGE')
     print(avg)
     print('===========================================')
 
     # For an aggregate, and for one indicator, retrieve the sum of all the indicator_value (for a years range)
     print(
         'For an aggregate, and for one indicator, retrieve the average of all the indicator_value (for a years range)')
-    avg = retrieveaggregatefromsql(aggregate=coutries_id, indicators=indicators[0], year=(2010, 2012), type_='AVERAGE')
+    avg = retrieveaggregatestats(aggregate='Africa', indicators=indicators[0], year=(2010, 2012), type_='AVERAGE')
     print(avg)
     print('===========================================')
 
     # 'For an aggregate, and for one indicator, retrieve the maximum value of all the indicator_value and return the country that has the maximum of all the indicator_value (for a specific year) '
     print(
         'For an aggregate, and for one indicator, retrieve the maximum value of all the indicator_value and return the country that has the maximum of all the indicator_value (for a specific year) ')
-    max = retrieveaggregatefromsql(aggregate=coutries_id, indicators=indicators[0], year=2010, type_='MAX')
+    max = retrieveaggregatestats(aggregate='Africa', indicators=indicators[0], year=2010, type_='MAX')
     print(max)
     print('===========================================')
 
     # For an aggregate, and for one indicator, retrieve the maximum value of all the indicator_value and return the country that has the maximum of all the indicator_value (for a specific year)
     print(
         'For an aggregate, and for one indicator, retrieve the maximum value of all the indicator_value and return the country that has the maximum of all the indicator_value (for a years range) ')
-    max = retrieveaggregatefromsql(aggregate=coutries_id, indicators=indicators[0], year=(2010, 2012), type_='MAX')
+    max = retrieveaggregatestats(aggregate='Africa', indicators=indicators[0], year=(2010, 2012), type_='MAX')
     print(max)
     print('===========================================')
 
     # 'For an aggregate, and for one indicator, retrieve the maximum value of all the indicator_value and return the country that has the maximum of all the indicator_value (for a specific year) '
     print(
         'For an aggregate, and for one indicator, retrieve the minimum value of all the indicator_value and return the country that has the maximum of all the indicator_value (for a specific year) ')
-    min = retrieveaggregatefromsql(aggregate=coutries_id, indicators=indicators[0], year=2010, type_='MIN')
+    min = retrieveaggregatestats(aggregate='Africa', indicators=indicators[0], year=2010, type_='MIN')
     print(min)
     print('===========================================')
 
     # For an aggregate, and for one indicator, retrieve the maximum value of all the indicator_value and return the country that has the maximum of all the indicator_value (for a specific year)
     print(
         'For an aggregate, and for one indicator, retrieve the minimum value of all the indicator_value and return the country that has the minimum of all the indicator_value (for a years range) ')
-    min = retrieveaggregatefromsql(aggregate=coutries_id, indicators=indicators[0], year=(2010, 2012), type_='MIN')
+    min = retrieveaggregatestats(aggregate='Africa', indicators=indicators[0], year=(2010, 2012), type_='MIN')
     print(min)
     print('===========================================')
 
 
 def country_id_in_aggregate_checker(country_id):
-    commands = ''' 
-                SELECT * FROM aggregateDB  
-                WHERE country_id = {}
-            '''.format(country_id)
-
-    datas = read_table(commands=commands)
+    datas = read_query(queries.COUNTRY_AGGREGATES, (country_id,))
     return datas
 
 
@@ -747,23 +665,27 @@ def add_aggregate(data=dict()):
     if data['country_id'] not in country_id_list:
         insert_table('aggregateDB', [data])
         print('country in aggregatedb added')
+        refresh_aggregates(aggregate_names=[data['aggregate_name']])
+        new_generation()
     else:
         print('country in aggregatedb already exists')
 
 
 def get_countries_from_aggregate(name):
-    commands = ''' 
-                    SELECT country_id FROM aggregateDB  
-                    WHERE aggregate_name = '{}'
-                '''.format(name)
-
-    datas = read_table(commands=commands)
+    datas = read_query(queries.AGGREGATE_COUNTRIES, (name,))
     return datas
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--offline', action='store_true', default=OFFLINE,
+                        help='serve World Bank API responses only from the local cache')
+    parser.add_argument('--mode', choices=REFRESH_MODES, default=REFRESH_MODE,
+                        help='full: reload indicatorDB through a staging table, delta: fetch and upsert only missing or stale cells')
+    args = parser.parse_args()
+
     answer = input('Input type: \n'
-                   'Y: Create the database and populate data from wbdata,\n'
+                   'Y: Create the database and populate data from the World Bank API,\n'
                    'N: Delete database,\n'
                    'SC: Show country data from indicatorsdb,\n'
                    'AA: Add aggregate to aggregatedb \n'
@@ -772,12 +694,13 @@ if __name__ == '__main__':
                    'DC: Delete country from an aggregatedb \n'
                    'Input: ')
 
-    # Create database, table and retrieve data from wbdata
+    # Create database, table and retrieve data from the World Bank API
     if answer == 'Y':
         create_db()
         create_table()
+        upgrade_schema()
         init_dataset()
-        retrieve_external_data()
+        retrieve_external_data(offline=args.offline, mode=args.mode)
 
     # Drop table
     elif answer == 'N':
@@ -822,15 +745,13 @@ if __name__ == '__main__':
         new_country = ['BEN', 'BJ', 'Benin', 'Porto-Novo']
 
         # insert to table countrydb
-        country_dict = dict()  # country_dict must this format: {'country_id': '', 'country_name': '', 'country_ISOid': ''}
-        country_dict['country_id'] = len(country_list) + 1
-        country_dict['country_name'] = new_country[2]
-        country_dict['country_ISOid'] = new_country[0]
-        country_list.append(country_dict)
+        new_record = CountryRecord(len(country_list) + 1, new_country[2], new_country[1], new_country[0], new_country[3])
+        get_catalog().add_country(new_record)
+        country_list.append(country_dict(new_record))
 
-        # getting new data from wbdata
+        # getting new data from the World Bank API
         Country_table.append(new_country)
-        retrieve_external_data()
+        retrieve_external_data(offline=args.offline, mode=args.mode)
 
         # add country to aggregatedb
         data = {
@@ -0,0 +1,124 @@
+"""Local stand-in for the World Bank v2 API, serving deterministic synthetic data.
+
+    python -m wbscript.stub_server --port 8999 --latency 0.05 --failure-rate 0.1
+    EED_WB_API_URL=http://127.0.0.1:8999/v2 python -m wbscript.run
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from wbscript.catalog import get_catalog
+
+DATA_PATH = re.compile(r'^/v2/countr(?:y|ies)/([^/]+)/indicators?/([^/]+)/?$')
+
+
+def stub_value(country, indicator_code, year, seed=0):
+    """deterministic value for a cell, None for about 5% of the cells"""
+    h = zlib.crc32('{}|{}|{}|{}'.format(seed, country, indicator_code, year).encode())
+    if h % 20 == 0:
+        return None
+    return round((h % 1000000) / 100.0, 2)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+        if server.latency:
+            time.sleep(server.latency)
+        if server.failure_rate and server.random.random() < server.failure_rate:
+            self.send_json(503, {'error': 'stub failure'})
+            return
+
+        url = urllib.parse.urlsplit(self.path)
+        match = DATA_PATH.match(url.path)
+        if not match:
+            self.send_json(200, [{'message': [{'id': '120', 'key': 'Invalid value',
+                                               'value': 'The provided parameter value is not valid'}]}])
+            return
+        params = dict(urllib.parse.parse_qsl(url.query))
+        self.send_json(200, self.data_page(match.group(1), urllib.parse.unquote(match.group(2)), params))
+
+    def data_page(self, countries, indicator_code, params):
+        start, _, end = params.get('date', '2010:2019').partition(':')
+        years = range(int(end or start), int(start) - 1, -1)
+        per_page = int(params.get('per_page', 50))
+        page = int(params.get('page', 1))
+        catalog = get_catalog()
+        indicator = catalog.indicator(indicator_code)
+        indicator_name = indicator.name if indicator else indicator_code
+
+        cells = [(c, y) for c in countries.split(';') for y in years]
+        pages = max(1, -(-len(cells) // per_page))
+        items = []
+        for country_code, year in cells[(page - 1) * per_page:page * per_page]:
+            country = catalog.country(country_code)
+            items.append({
+                'indicator': {'id': indicator_code, 'value': indicator_name},
+                'country': {'id': country.iso2 if country else country_code,
+                            'value': country.name if country else country_code},
+                'countryiso3code': country.iso3 if country else country_code,
+                'date': str(year),
+                'value': stub_value(country_code, indicator_code, year, self.server.seed),
+                'unit': '',
+                'obs_status': '',
+                'decimal': 1,
+            })
+        header = {'page': page, 'pages': pages, 'per_page': per_page, 'total': len(cells),
+                  'sourceid': '2', 'lastupdated': '2020-07-01'}
+        return [header, items]
+
+
+def make_stub_server(host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0, seed=0, verbose=False):
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.failure_rate = failure_rate
+    server.seed = seed
+    server.verbose = verbose
+    server.random = random.Random(seed)
+    server.lock = threading.Lock()
+    server.request_count = 0
+    server.api_url = 'http://{}:{}/v2'.format(*server.server_address[:2])
+    return server
+
+
+def start_stub_server(**kwargs):
+    """start a stub server in a background thread, returns the server (see server.api_url)"""
+    server = make_stub_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8999)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of requests answered with 503')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    stub = make_stub_server(args.host, args.port, args.latency, args.failure_rate, args.seed, verbose=True)
+    print('World Bank API stub on', stub.api_url)
+    stub.serve_forever()